@@ -0,0 +1,112 @@
+"""
+Resident memory of debates in flight.
+
+Plays debates over the bundled CommonMT inputs with the replay backend, so the answers have the
+size of real ones, keeps all of them alive like the debates of a concurrent run waiting to be saved,
+and reports the memory traced per debate and how much of the message text is held more than once.
+It also times building the api payloads of the histories, joining the parts of every message per
+query against keeping the joined contents while a debate is in flight, and what those copies cost.
+
+    python3 code/bench_memory.py --limit 100 --max-round 3
+"""
+
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from utils.agent import Agent
+from utils.backends import ReplayBackend
+from utils.message import to_dicts
+from debate4tran import DebateFactory
+
+MAD_path = os.path.abspath(__file__).rsplit("/", 2)[0]
+
+
+def load_items(limit: int) -> "list[dict]":
+    raw_dir = f"{MAD_path}/data/CommonMT/Lexical_Ambiguity/raw"
+    sources = open(f"{raw_dir}/lexical.zh-en.zh").read().splitlines()
+    references = open(f"{raw_dir}/lexical.zh-en.en").read().splitlines()
+    items = [{"source": source, "reference": reference} for source, reference in zip(sources, references)]
+    return items[:limit]
+
+
+def text_stats(debates: list) -> dict:
+    # characters of the message contents as sent, and as stored: parts held by several messages count once
+    sent, stored, seen = 0, 0, set()
+    for debate in debates:
+        for player in debate.players:
+            for message in player.memory_lst:
+                sent += len(message["content"])
+                for part in getattr(message, "parts", (message["content"],)):
+                    if id(part) not in seen:
+                        seen.add(id(part))
+                        stored += len(part)
+    return {"sent_chars": sent, "stored_chars": stored}
+
+
+def payload_stats(debates: list, repeat: int) -> dict:
+    # every player's history built into a payload repeat times, as often as later queries send it again
+    memories = [player.memory_lst for debate in debates for player in debate.players]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for memory_lst in memories:
+            to_dicts(memory_lst)
+    joined = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for memory_lst in memories:
+            to_dicts(memory_lst, hold=True)
+    held = time.perf_counter() - start
+    held_chars = sum(len(message.joined) for memory_lst in memories for message in memory_lst if message.joined is not None)
+    for debate in debates:
+        for player in debate.players:
+            player.release()
+    return {"join_per_query_seconds": joined, "join_once_seconds": held, "held_chars": held_chars}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("-d", "--transcript-dir", type=str, default=None, help="Dir of MAD transcripts the replay backend answers from")
+    parser.add_argument("--limit", type=int, default=100, help="Debates kept alive at the same time")
+    parser.add_argument("--max-round", type=int, default=3, help="Maximum rounds of every debate")
+    parser.add_argument("--repeat", type=int, default=10, help="Payloads built of every history for the timing")
+    parser.add_argument("-m", "--model-name", type=str, default="gpt-3.5-turbo", help="Model name")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    Agent.backend = ReplayBackend(args.transcript_dir or f"{MAD_path}/data/CommonMT/Lexical_Ambiguity/MAD_Debate_Process")
+    config = json.load(open(f"{MAD_path}/code/utils/config4tran.json"))
+    config.update({"src_lng": "Chinese", "tgt_lng": "English"})
+    items = load_items(args.limit)
+    with tempfile.TemporaryDirectory(prefix="mad-bench-") as save_file_dir, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        factory = DebateFactory(config, save_file_dir, "bench-key", model_name=args.model_name, max_round=args.max_round)
+        # the tokenizer and the templates are loaded once per process, not per debate
+        factory.run(len(items), items[0])
+        tracemalloc.start()
+        debates = [factory.run(id, item) for id, item in enumerate(items)]
+    traced, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = text_stats(debates)
+    payload = payload_stats(debates, args.repeat)
+    report = {
+        "debates": len(debates),
+        "bytes_per_debate": traced // len(debates),
+        "peak_bytes": peak,
+        "messages_per_debate": sum(len(player.memory_lst) for debate in debates for player in debate.players) / len(debates),
+        "sent_chars_per_debate": stats["sent_chars"] // len(debates),
+        "stored_chars_per_debate": stats["stored_chars"] // len(debates),
+        "payload_join_per_query_seconds": round(payload["join_per_query_seconds"], 4),
+        "payload_join_once_seconds": round(payload["join_once_seconds"], 4),
+        "held_chars_per_debate_in_flight": payload["held_chars"] // len(debates),
+    }
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,75 @@
+"""
+Microbenchmark for the token accounting in Agent.ask.
+
+Replays the messages of the bundled MAD transcripts into an agent, asking after every
+message, and compares re-tokenizing the whole memory (the old Agent.ask) against the
+running total kept by Agent.
+
+    python3 code/bench_tokens.py --turns 10 20 40 80
+"""
+
+
+import os
+import json
+import glob
+import time
+import argparse
+import tiktoken
+from utils.agent import Agent
+from utils.openai_utils import model2max_context
+
+
+def load_messages(transcript_dir: str, limit: int) -> "list[str]":
+    messages = []
+    for path in sorted(glob.glob(os.path.join(transcript_dir, "*.json")))[:limit]:
+        transcript = json.load(open(path))
+        for memory_lst in transcript["players"].values():
+            messages.extend(m["content"] for m in memory_lst)
+    return messages
+
+
+def full_recount(agent: Agent) -> int:
+    # what Agent.ask did before: build the encoder and re-tokenize every message
+    num_context_token = sum([len(tiktoken.encoding_for_model(agent.model_name).encode(m["content"])) for m in agent.memory_lst])
+    return model2max_context[agent.model_name] - num_context_token
+
+
+def incremental(agent: Agent) -> int:
+    return model2max_context[agent.model_name] - agent.num_context_token
+
+
+def bench(messages: "list[str]", turns: int, model_name: str, count) -> float:
+    agent = Agent(model_name, "bench", 0)
+    start = time.perf_counter()
+    for i in range(turns):
+        agent.add_event(messages[i % len(messages)])
+        count(agent)
+    return time.perf_counter() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("-d", "--transcript-dir", type=str, default=None, help="Dir of MAD transcripts used as message text")
+    parser.add_argument("-m", "--model-name", type=str, default="gpt-3.5-turbo", help="Model name")
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 20, 40, 80], help="Transcript lengths to measure")
+    parser.add_argument("--repeat", type=int, default=3, help="Best of N runs")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    MAD_path = os.path.abspath(__file__).rsplit("/", 2)[0]
+    transcript_dir = args.transcript_dir or f"{MAD_path}/data/CommonMT/Lexical_Ambiguity/MAD_Debate_Process"
+    messages = load_messages(transcript_dir, limit=20)
+
+    # build the encoder once so neither side pays the first load
+    tiktoken.encoding_for_model(args.model_name)
+
+    print(f"{'turns':>6} {'recount (ms)':>14} {'incremental (ms)':>18} {'speedup':>9}")
+    for turns in args.turns:
+        before = min(bench(messages, turns, args.model_name, full_recount) for _ in range(args.repeat))
+        after = min(bench(messages, turns, args.model_name, incremental) for _ in range(args.repeat))
+        print(f"{turns:>6} {before * 1000:>14.2f} {after * 1000:>18.2f} {before / after:>8.1f}x")
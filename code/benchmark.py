@@ -0,0 +1,223 @@
+"""
+End-to-end benchmark of the debate orchestration against a simulated backend.
+
+Runs Debate over the bundled CommonMT inputs and/or CIAR questions with a MockBackend
+(or the replay backend for CommonMT) and writes a json report with debates per minute,
+per-round latency percentiles, api calls and tokens per item and time lost outside the api.
+
+    python3 code/benchmark.py --task commonmt ciar --limit 50 -c 8 --latency 0.5 --error-rate 0.02 --report bench.json
+"""
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+from tqdm import tqdm
+from utils.agent import Agent
+from utils.backends import Backend, MockBackend, ReplayBackend
+from utils.rate_limiter import RateLimiter
+from utils.runner import ordered_map
+from utils.openai_utils import num_tokens_from_string
+from debate4tran import Debate, DebateFactory
+from utils.templates import compile_templates
+from utils.consensus import ConsensusDetector
+
+MAD_path = os.path.abspath(__file__).rsplit("/", 2)[0]
+sys.path.insert(0, MAD_path)
+import interactive
+
+
+class InstrumentedBackend(Backend):
+    def __init__(self, backend: Backend) -> None:
+        """Record every request that reaches the backend
+
+        Args:
+            backend (Backend): the backend doing the work
+        """
+        self.backend = backend
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def supports(self, model_name: str) -> bool:
+        return self.backend.supports(model_name)
+
+    def chat(self, model_name: str, messages: "list[dict]", temperature: float, max_tokens: int, api_key: str, agent_name: str=None, turn: int=None) -> str:
+        call = {
+            "item": getattr(self.local, "item", None),
+            "agent": agent_name,
+            "prompt_tokens": sum(num_tokens_from_string(m["content"], model_name) for m in messages),
+            "completion_tokens": 0,
+            "error": None,
+            "start": time.perf_counter(),
+        }
+        try:
+            gen = self.backend.chat(model_name, messages, temperature, max_tokens, api_key, agent_name=agent_name, turn=turn)
+            call["completion_tokens"] = num_tokens_from_string(gen, model_name)
+            return gen
+        except Exception as e:
+            call["error"] = type(e).__name__
+            raise
+        finally:
+            call["end"] = time.perf_counter()
+            with self.lock:
+                self.calls.append(call)
+
+
+def load_items(task: str, limit: int) -> "list[tuple]":
+    if task == "commonmt":
+        raw_dir = f"{MAD_path}/data/CommonMT/Lexical_Ambiguity/raw"
+        sources = open(f"{raw_dir}/lexical.zh-en.zh").read().splitlines()
+        references = open(f"{raw_dir}/lexical.zh-en.en").read().splitlines()
+        items = [(task, {"source": source, "reference": reference}) for source, reference in zip(sources, references)]
+    else:
+        items = [(task, item["question"]) for item in json.load(open(f"{MAD_path}/data/CounterintuitiveQA/CIAR.json"))]
+    return items[:limit] if limit else items
+
+
+def percentile(values: "list[float]", q: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def summarize(durations: "list[float]") -> dict:
+    return {
+        "count": len(durations),
+        "mean": sum(durations) / len(durations) if durations else None,
+        "p50": percentile(durations, 50),
+        "p95": percentile(durations, 95),
+        "max": max(durations) if durations else None,
+    }
+
+
+def round_latencies(calls: "list[dict]", start: float) -> "dict[str, list[float]]":
+    """Split the successful calls of one debate into rounds, a round ends with a moderator verdict"""
+    rounds = {}
+    boundary = start
+    num_round = 1
+    for call in sorted((c for c in calls if c["error"] is None), key=lambda c: c["end"]):
+        if call["agent"] == "Baseline":
+            rounds.setdefault("base", []).append(call["end"] - boundary)
+            boundary = call["end"]
+        elif call["agent"] == "Moderator":
+            rounds.setdefault(f"round_{num_round}", []).append(call["end"] - boundary)
+            boundary = call["end"]
+            num_round += 1
+    judge = [c for c in calls if c["agent"] == "Judge" and c["error"] is None]
+    if judge:
+        rounds["judge"] = [max(c["end"] for c in judge) - boundary]
+    return rounds
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--task", type=str, nargs="+", default=["commonmt", "ciar"], choices=["commonmt", "ciar"], help="Datasets to run")
+    parser.add_argument("--limit", type=int, default=20, help="Items per task, 0 for all")
+    parser.add_argument("--backend", type=str, default="mock", choices=["mock", "replay"], help="Simulated backend, replay only serves commonmt")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Uniform +/- jitter of the latency")
+    parser.add_argument("--agree-round", type=int, default=2, help="Round from which mock debaters agree and mock moderators decide")
+    parser.add_argument("--consensus-threshold", type=float, default=None, help="Skip the moderator when both sides agree, see debate4tran.py")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests failing with a retryable error (mock only)")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="Number of debates in flight at the same time")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute of the shared rate limiter")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute of the shared rate limiter")
+    parser.add_argument("-m", "--model-name", type=str, default="gpt-3.5-turbo", help="Model name")
+    parser.add_argument("--report", type=str, default=None, help="Json report path, printed if not given")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.backend == "replay":
+        backend = InstrumentedBackend(ReplayBackend(f"{MAD_path}/data/CommonMT/Lexical_Ambiguity/MAD_Debate_Process", latency=args.latency))
+    else:
+        backend = InstrumentedBackend(MockBackend(latency=args.latency, jitter=args.jitter, agree_round=args.agree_round, error_rate=args.error_rate))
+    rate_limiter = RateLimiter(rpm=args.rpm, tpm=args.tpm) if args.rpm or args.tpm else None
+    # interactive.py imports the agent as code.utils.agent, a second copy of the class
+    for agent_cls in {Agent, interactive.Agent}:
+        agent_cls.backend = backend
+        agent_cls.rate_limiter = rate_limiter
+        agent_cls.response_cache = None
+    if args.consensus_threshold is not None:
+        Debate.consensus = ConsensusDetector(threshold=args.consensus_threshold)
+        interactive.Debate.consensus = ConsensusDetector(threshold=args.consensus_threshold, numeric=True)
+
+    config4tran = json.load(open(f"{MAD_path}/code/utils/config4tran.json"))
+    config4tran.update({"src_lng": "Chinese", "tgt_lng": "English"})
+    config4all = json.load(open(f"{MAD_path}/code/utils/config4all.json"))
+    templates4all = compile_templates(config4all, interactive.TEMPLATE_FIELDS)
+
+    items = [(id, item) for task in args.task for id, item in enumerate(load_items(task, args.limit))]
+    debate_times = {}
+
+    def worker(item):
+        id, (task, input) = item
+        backend.local.item = (task, id)
+        start = time.perf_counter()
+        if task == "commonmt":
+            factory.run(id, input)
+        else:
+            config = dict(config4all)
+            config["debate_topic"] = input
+            interactive.Debate(model_name=args.model_name, num_players=3, openai_api_key="bench-key", config=config, temperature=0, templates=templates4all).run()
+        debate_times[(task, id)] = (start, time.perf_counter())
+
+    # the outputs and journals of the debates are not kept
+    with tempfile.TemporaryDirectory(prefix="mad-bench-") as save_file_dir:
+        factory = DebateFactory(config4tran, save_file_dir, "bench-key", model_name=args.model_name)
+        start = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for _ in tqdm(ordered_map(worker, items, concurrency=args.concurrency), total=len(items), file=sys.stderr):
+                pass
+        wall_time = time.perf_counter() - start
+
+    calls_of_item = {}
+    for call in backend.calls:
+        calls_of_item.setdefault(call["item"], []).append(call)
+
+    rounds = {}
+    for key, (debate_start, _) in debate_times.items():
+        for name, durations in round_latencies(calls_of_item.get(key, []), debate_start).items():
+            rounds.setdefault(name, []).extend(durations)
+
+    num_items = len(debate_times)
+    api_time = sum(c["end"] - c["start"] for c in backend.calls)
+    debate_time = sum(end - start for start, end in debate_times.values())
+    limiter_wait = sum(s["wait_time"] for s in rate_limiter.report().values()) if rate_limiter else 0.0
+    report = {
+        "config": vars(args),
+        "items": num_items,
+        "wall_time": wall_time,
+        "debates_per_minute": num_items / wall_time * 60,
+        "debate_latency": summarize([end - start for start, end in debate_times.values()]),
+        "round_latency": {name: summarize(durations) for name, durations in sorted(rounds.items())},
+        "api_calls_per_item": len(backend.calls) / num_items,
+        "failed_calls": sum(1 for c in backend.calls if c["error"] is not None),
+        "prompt_tokens_per_item": sum(c["prompt_tokens"] for c in backend.calls) / num_items,
+        "completion_tokens_per_item": sum(c["completion_tokens"] for c in backend.calls) / num_items,
+        "consensus": {"commonmt": Debate.consensus.report(), "ciar": interactive.Debate.consensus.report()} if args.consensus_threshold is not None else None,
+        "api_latency": summarize([c["end"] - c["start"] for c in backend.calls]),
+        # summed over debates: time spent inside the api, waiting on the rate limiter, and the rest (sleep, backoff, local work)
+        "time_breakdown": {
+            "api": api_time,
+            "rate_limiter_wait": limiter_wait,
+            "sleep_backoff_and_local": debate_time - api_time - limiter_wait,
+        },
+    }
+
+    report_str = json.dumps(report, indent=4)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(report_str)
+    print(report_str)
@@ -0,0 +1,90 @@
+"""
+Check that streamed debates give their pooled connections back.
+
+Runs streamed debates through the openai backend against utils.mock_server with a small
+connection pool. Moderator verdicts stop reading at their closing brace; a response that is not
+released keeps its connection, and with a blocking pool the run hangs once all are taken.
+Exits with 1 if the debates do not finish within the timeout.
+
+    python3 code/check_stream_pool.py --pool-size 2 --debates 20 --timeout 60
+"""
+
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import threading
+import contextlib
+from utils.agent import Agent
+from utils.backends import OpenAIBackend, MockBackend
+from utils.http_client import HTTPClient
+from utils.mock_server import serve_mock
+from utils.runner import ordered_map
+from debate4tran import DebateFactory
+
+MAD_path = os.path.abspath(__file__).rsplit("/", 2)[0]
+
+
+class TrailingMockBackend(MockBackend):
+    def answer(self, messages: "list[dict]", turn: int=None) -> str:
+        # models often explain a verdict after its json, which a streamed verdict never reads
+        answer = super().answer(messages, turn)
+        return f"{answer} I hope this verdict helps." if answer.startswith("{") else answer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--pool-size", type=int, default=2, help="Keep-alive connections of the client")
+    parser.add_argument("--debates", type=int, default=20, help="Debates to run")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Debates in flight at the same time")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds before the run counts as hung")
+
+    return parser.parse_args()
+
+
+def check(args, chunked: bool) -> dict:
+    """Run the debates against a mock server streaming in chunked encoding or until the connection closes
+
+    Returns:
+        dict: the connection stats of the client and the debates finished within the timeout
+    """
+    server = serve_mock(TrailingMockBackend(token_latency=0.002), chunked=chunked)
+    host, port = server.server_address
+    client = HTTPClient(pool_size=args.pool_size, pool_timeout=args.timeout)
+    Agent.backend = OpenAIBackend(api_base=f"http://{host}:{port}/v1", client=client)
+
+    config = json.load(open(f"{MAD_path}/code/utils/config4tran.json"))
+    config.update({"src_lng": "Chinese", "tgt_lng": "English"})
+    items = [(id, {"source": f"第{id}句话。", "reference": f"Sentence {id}."}) for id in range(args.debates)]
+    finished = []
+
+    def run(factory):
+        for debate in ordered_map(lambda item: factory.run(*item), items, concurrency=args.concurrency):
+            finished.append(debate)
+
+    # a hung run may still hold files in the directory when it is removed
+    with tempfile.TemporaryDirectory(prefix="mad-check-", ignore_cleanup_errors=True) as save_file_dir, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        thread = threading.Thread(target=run, args=(DebateFactory(config, save_file_dir, "sk-check", stream=True),), daemon=True)
+        thread.start()
+        thread.join(args.timeout)
+    if not thread.is_alive():
+        server.shutdown()
+        client.close()
+    return dict(client.report(), debates=len(finished))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    hung = False
+    for chunked in (True, False):
+        report = check(args, chunked)
+        print(json.dumps(dict(report, streams="chunked" if chunked else "until close")), flush=True)
+        hung = hung or report["debates"] < args.debates
+    if hung:
+        print(f"hung: not all {args.debates} debates finished within {args.timeout}s", file=sys.stderr, flush=True)
+        # the pool threads of a hung run never finish, so do not wait for them at exit
+        os._exit(1)
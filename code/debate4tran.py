@@ -18,12 +18,36 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
 import os
+import copy
 import json
 import random
 # random.seed(0)
 import argparse
+import itertools
+import contextlib
+import threading
+from concurrent.futures import Future
 from langcodes import Language
 from utils.agent import Agent
+from utils.runner import ordered_map
+from utils.rate_limiter import RateLimiter
+from utils.response_cache import ResponseCache
+from utils.journal import Journal
+from utils.backends import OpenAIBackend, ReplayBackend, MockBackend
+from utils.http_client import HTTPClient
+from utils.verdict import VerdictStream, VerdictParser, VerdictError, REPAIR_PROMPT
+from utils.memory import MemoryPolicy
+from utils.key_pool import KeyPool
+from utils.corpus import read_corpus, parse_shard, FORMATS
+from utils.templates import PromptTemplate, compile_templates
+from utils.message import to_dicts
+from utils.result_store import ResultStore
+from utils.consensus import ConsensusDetector
+from utils.tracing import Tracer
+from utils.event_log import EventLog
+from utils.budget import Budget, BudgetExceededException, CompletionCaps
+from utils.batch import BatchRunner, LocalBatchRunner, OpenAIBatchRunner, batch_request
+from utils.openai_utils import model2max_context, num_tokens_from_string
 from datetime import datetime
 from tqdm import tqdm
 
@@ -34,8 +58,35 @@ NAME_LIST=[
     "Moderator",
 ]
 
+TASK_FIELDS = {"src_lng", "tgt_lng", "source", "base_translation"}
+# prompt template -> placeholders it may use
+TEMPLATE_FIELDS = {
+    "base_prompt": TASK_FIELDS,
+    "player_meta_prompt": TASK_FIELDS,
+    "moderator_meta_prompt": TASK_FIELDS,
+    "affirmative_prompt": TASK_FIELDS,
+    "negative_prompt": {"aff_ans"},
+    "moderator_prompt": {"aff_ans", "neg_ans", "round"},
+    "judge_prompt_last1": {"aff_ans", "neg_ans"},
+    "judge_prompt_last2": TASK_FIELDS,
+    "debate_prompt": {"oppo_ans"},
+}
+# more templates of debates with more than two debaters
+PANEL_TEMPLATE_FIELDS = {
+    "panel_moderator_meta_prompt": TASK_FIELDS,
+    "panel_debate_prompt": set(),
+    "panel_moderator_prompt": {"round"},
+    "panel_judge_prompt_last1": {"answers"},
+    "panel_persona_prompt": {"name", "persona"},
+}
+
+MODERATOR_KEYS = ["Whether there is a preference", "Supported Side", "Reason", "debate_translation"]
+JUDGE_KEYS = ["Reason", "debate_translation"]
+# sides a moderator of a two-sided debate may support
+SIDES = ["Affirmative", "Negative"]
+
 class DebatePlayer(Agent):
-    def __init__(self, model_name: str, name: str, temperature:float, openai_api_key: str, sleep_time: float) -> None:
+    def __init__(self, model_name: str, name: str, temperature:float, openai_api_key: str, sleep_time: float, journal: Journal=None, budget: Budget=None) -> None:
         """Create a player in the debate
 
         Args:
@@ -44,12 +95,21 @@ class DebatePlayer(Agent):
             temperature (float): higher values make the output more random, while lower values make it more focused and deterministic
             openai_api_key (str): As the parameter name suggests
             sleep_time (float): sleep because of rate limits
+            journal (Journal): write-ahead journal of the debate, None to disable
+            budget (Budget): token and cost budget of the debate, None for no limit
         """
         super(DebatePlayer, self).__init__(model_name, name, temperature, sleep_time)
         self.openai_api_key = openai_api_key
+        self.journal = journal
+        self.budget = budget
 
 
 class Debate:
+    # process-wide VerdictParser, its counters cover every debate
+    verdict_parser = VerdictParser()
+    # opt-in process-wide ConsensusDetector, a round both sides agree on is decided without the moderator
+    consensus = None
+
     def __init__(self,
             model_name: str='gpt-3.5-turbo', 
             temperature: float=0, 
@@ -58,19 +118,31 @@ class Debate:
             openai_api_key: str=None,
             prompts_path: str=None,
             max_round: int=3,
-            sleep_time: float=0
+            sleep_time: float=0,
+            journal: Journal=None,
+            stream: bool=False,
+            speculative_judge: bool=False,
+            config: dict=None,
+            templates: "dict[str, PromptTemplate]"=None,
+            budget: Budget=None
         ) -> None:
         """Create a debate
 
         Args:
             model_name (str): openai model name
             temperature (float): higher values make the output more random, while lower values make it more focused and deterministic
-            num_players (int): num of players
+            num_players (int): num of players, the moderator and two debaters, or a panel of num_players - 1 debaters whose turns of a round run concurrently
             save_file_dir (str): dir path to json file
             openai_api_key (str): As the parameter name suggests
-            prompts_path (str): prompts path (json file)
+            prompts_path (str): prompts path (json file), only read when no config is given
             max_round (int): maximum Rounds of Debate
             sleep_time (float): sleep because of rate limits
+            journal (Journal): write-ahead journal of every agent turn, a debate rebuilt with the same journal resumes without repeating calls
+            stream (bool): stream the answers, moderator verdicts are read only until they are decided
+            speculative_judge (bool): ask the judge for the candidates during the last round, which saves its latency if the moderator stays undecided and wastes a call otherwise
+            config (dict): prompts and task fields, as in the prompts file
+            templates (dict[str, PromptTemplate]): compiled templates of the config, compiled here if not given
+            budget (Budget): token and cost budget of the debate; past its soft limit the debate goes straight to the judge
         """
 
         self.model_name = model_name
@@ -80,6 +152,14 @@ class Debate:
         self.openai_api_key = openai_api_key
         self.max_round = max_round
         self.sleep_time = sleep_time
+        self.journal = journal
+        self.stream = stream
+        self.budget = budget
+        self.budget_stopped = False
+        # the hard limit of the budget was hit, the debate ends without asking anyone else
+        self.budget_exhausted = False
+        self.speculative_judge = speculative_judge
+        self.panel = num_players > 3
 
         # init save file
         now = datetime.now()
@@ -91,6 +171,7 @@ class Debate:
             'temperature': temperature,
             'num_players': num_players,
             'success': False,
+            'consensus': False,
             "src_lng": "",
             "tgt_lng": "",
             'source': '',
@@ -101,65 +182,207 @@ class Debate:
             "Supported Side": '',
             'players': {},
         }
-        prompts = json.load(open(prompts_path))
-        self.save_file.update(prompts)
+        if config is None:
+            config = json.load(open(prompts_path))
+        # the panel_* keys only belong to panel debates
+        self.save_file.update({key: value for key, value in config.items() if self.panel or not key.startswith("panel_")})
+        self.templates = templates if templates is not None else compile_templates(config, dict(TEMPLATE_FIELDS, **PANEL_TEMPLATE_FIELDS) if self.panel else TEMPLATE_FIELDS)
         self.init_prompt()
 
-        if self.save_file['base_translation'] == "":
-            self.create_base()
+        # rounds played, the first one while initializing
+        self.round = 1
+        self.mod_ans = {key: '' for key in MODERATOR_KEYS}
+        try:
+            # a panel asks the baseline together with the openings of the debaters
+            if self.save_file['base_translation'] == "" and not self.panel:
+                self.create_base()
+            self.save_file['affirmative_prompt'] = self.templates['affirmative_prompt'].render(self.save_file)
 
-        # creat&init agents
-        self.creat_agents()
-        self.init_agents()
+            # creat&init agents
+            self.creat_agents()
+            self.init_agents()
+        except BudgetExceededException as e:
+            self.exhausted(e)
 
 
     def init_prompt(self):
-        def prompt_replace(key):
-            self.save_file[key] = self.save_file[key].replace("##src_lng##", self.save_file["src_lng"]).replace("##tgt_lng##", self.save_file["tgt_lng"]).replace("##source##", self.save_file["source"]).replace("##base_translation##", self.save_file["base_translation"])
-        prompt_replace("base_prompt")
-        prompt_replace("player_meta_prompt")
-        prompt_replace("moderator_meta_prompt")
-        prompt_replace("judge_prompt_last2")
+        keys = ["base_prompt", "player_meta_prompt", "moderator_meta_prompt", "judge_prompt_last2"]
+        if self.panel:
+            keys.append("panel_moderator_meta_prompt")
+        for key in keys:
+            self.save_file[key] = self.templates[key].render(self.save_file)
 
     def create_base(self):
-        print(f"\n===== Translation Task =====\n{self.save_file['base_prompt']}\n")
-        agent = DebatePlayer(model_name=self.model_name, name='Baseline', temperature=self.temperature, openai_api_key=self.openai_api_key, sleep_time=self.sleep_time)
-        agent.add_event(self.save_file['base_prompt'])
-        base_translation = agent.ask()
-        agent.add_memory(base_translation)
+        self.log("task", f"\n===== Translation Task =====\n{self.save_file['base_prompt']}\n", prompt=self.save_file['base_prompt'])
+        agent = self.new_baseline()
+        base_translation = self.ask_player(agent)
         self.save_file['base_translation'] = base_translation
-        self.save_file['affirmative_prompt'] = self.save_file['affirmative_prompt'].replace("##base_translation##", base_translation)
+
+    def new_baseline(self) -> DebatePlayer:
+        agent = DebatePlayer(model_name=self.model_name, name='Baseline', temperature=self.temperature, openai_api_key=self.openai_api_key, sleep_time=self.sleep_time, journal=self.journal, budget=self.budget)
+        agent.role = "baseline"
+        agent.add_event(self.save_file['base_prompt'])
         self.save_file['players'][agent.name] = agent.memory_lst
+        return agent
 
     def creat_agents(self):
         # creates players
+        if self.panel:
+            names = [f"Debater {i + 1}" for i in range(self.num_players - 1)] + ["Moderator"]
+            roles = ["debater"] * (self.num_players - 1) + ["moderator"]
+        else:
+            names = NAME_LIST
+            roles = ["affirmative", "negative", "moderator"]
         self.players = [
-            DebatePlayer(model_name=self.model_name, name=name, temperature=self.temperature, openai_api_key=self.openai_api_key, sleep_time=self.sleep_time) for name in NAME_LIST
+            DebatePlayer(model_name=self.model_name, name=name, temperature=self.temperature, openai_api_key=self.openai_api_key, sleep_time=self.sleep_time, journal=self.journal, budget=self.budget) for name in names
         ]
-        self.affirmative = self.players[0]
-        self.negative = self.players[1]
-        self.moderator = self.players[2]
+        for player, role in zip(self.players, roles):
+            player.role = role
+        self.debaters = self.players[:-1]
+        self.moderator = self.players[-1]
+        if not self.panel:
+            self.affirmative = self.players[0]
+            self.negative = self.players[1]
 
     def init_agents(self):
+        if self.panel:
+            return self.init_panel()
+
         # start: set meta prompt
         self.affirmative.set_meta_prompt(self.save_file['player_meta_prompt'])
         self.negative.set_meta_prompt(self.save_file['player_meta_prompt'])
         self.moderator.set_meta_prompt(self.save_file['moderator_meta_prompt'])
         
         # start: first round debate, state opinions
-        print(f"===== Debate Round-1 =====\n")
+        self.log("round", f"===== Debate Round-1 =====\n", round=1)
         self.affirmative.add_event(self.save_file['affirmative_prompt'])
-        self.aff_ans = self.affirmative.ask()
-        self.affirmative.add_memory(self.aff_ans)
+        self.aff_ans = self.ask_player(self.affirmative)
+
+        self.negative.add_event(self.templates['negative_prompt'].render_parts(aff_ans=self.aff_ans))
+        self.neg_ans = self.ask_player(self.negative)
+
+        self.mod_ans = self.moderate('first')
+
+    def init_panel(self):
+        # a stance of its own per debater, otherwise they send the same prompts and debate clones of one answer
+        personas = self.save_file['panel_personas']
+        for i, debater in enumerate(self.debaters):
+            persona = self.templates['panel_persona_prompt'].render_parts(name=debater.name, persona=personas[i % len(personas)])
+            debater.set_meta_prompt((self.save_file['player_meta_prompt'], "\n\n") + persona)
+            debater.add_event(self.save_file['base_prompt'])
+        self.moderator.set_meta_prompt(self.save_file['panel_moderator_meta_prompt'])
+
+        # openings are independent, the baseline is one more candidate answering the same prompt
+        self.log("round", f"===== Debate Round-1 =====\n", round=1)
+        if self.save_file['base_translation'] == "":
+            answers = self.ask_players([self.new_baseline()] + self.debaters)
+            self.save_file['base_translation'], self.answers = answers[0], answers[1:]
+        else:
+            self.answers = self.ask_players(self.debaters)
+        self.exchange()
+        self.mod_ans = self.moderate('first')
+
+    def ask_players(self, players: "list[DebatePlayer]") -> "list[str]":
+        """Ask independent players at the same time, a round takes as long as its slowest speaker
+
+        Args:
+            players (list[DebatePlayer]): the players to ask
+
+        Returns:
+            list[str]: their answers, in the order of players
+        """
+        return list(ordered_map(self.in_debate(self.ask_player), players, concurrency=len(players)))
+
+    def in_debate(self, fn):
+        # fn for another thread, whose spans and events still belong to this debate
+        trackers = [tracker for tracker in (Agent.tracer, Agent.event_log) if tracker is not None]
+        if not trackers:
+            return fn
+        debates = [tracker.current() for tracker in trackers]
+        def call(*args):
+            for tracker, debate in zip(trackers, debates):
+                tracker.attach(debate)
+            return fn(*args)
+        return call
+
+    def log(self, event: str, text: str, **fields):
+        # a summary event of the debate, printed as before when no event log is set
+        if Agent.event_log is None:
+            print(text)
+        else:
+            Agent.event_log.log(event, "summary", text=text, **fields)
+
+    def exchange(self):
+        # every debater hears the answers of the others, the moderator hears them all
+        for debater, ans in zip(self.debaters, self.answers):
+            self.speak(debater.name, ans)
+
+    def ask_player(self, player: DebatePlayer, verdict: bool=False, round: int=None) -> str:
+        """Ask a player and keep the answer in its memory, streaming the answer in stream mode
+
+        Args:
+            player (DebatePlayer): the player to ask
+            verdict (bool): the answer is a json verdict, stop reading once it is decided
+            round (int): round the answer belongs to in traces and logs, the current one if not given
+        """
+        round = self.round if round is None else round
+        if not self.stream:
+            ans = player.ask(round=round)
+        else:
+            verdict_stream = VerdictStream() if verdict else None
+            ans = player.ask(stream=True, until=verdict_stream.feed if verdict else None, round=round)
+            if verdict and verdict_stream.decided:
+                # the last piece may run past the closing brace
+                ans = ans[:verdict_stream.end]
+        player.add_memory(ans, round=round)
+        return ans
+
+    def moderate(self, round: str) -> dict:
+        """Verdict of a round, taken without asking the moderator when all debaters already agree
 
-        self.negative.add_event(self.save_file['negative_prompt'].replace('##aff_ans##', self.aff_ans))
-        self.neg_ans = self.negative.ask()
-        self.negative.add_memory(self.neg_ans)
+        Args:
+            round (str): "first", "second", ...
+
+        Returns:
+            dict: the verdict
+        """
+        if self.consensus is not None:
+            candidate = self.consensus.agree(self.answers if self.panel else [self.aff_ans, self.neg_ans])
+            if candidate is not None:
+                self.save_file['consensus'] = True
+                return {"Whether there is a preference": "Yes", "Supported Side": "All", "Reason": "All sides proposed the same translation.", "debate_translation": candidate}
+        if self.panel:
+            self.moderator.add_event(self.templates['panel_moderator_prompt'].render_parts(round=round))
+        else:
+            self.moderator.add_event(self.templates['moderator_prompt'].render_parts(aff_ans=self.aff_ans, neg_ans=self.neg_ans, round=round))
+        return self.ask_verdict(self.moderator, MODERATOR_KEYS)
+
+    def ask_verdict(self, player: DebatePlayer, keys: "list[str]") -> dict:
+        """Ask a player for a json verdict, re-asking once if the answer cannot be parsed
+
+        Args:
+            player (DebatePlayer): the moderator or the judge
+            keys (list[str]): keys of the verdict, debate_translation is required
 
-        self.moderator.add_event(self.save_file['moderator_prompt'].replace('##aff_ans##', self.aff_ans).replace('##neg_ans##', self.neg_ans).replace('##round##', 'first'))
-        self.mod_ans = self.moderator.ask()
-        self.moderator.add_memory(self.mod_ans)
-        self.mod_ans = eval(self.mod_ans)
+        Returns:
+            dict: the verdict, with an empty debate_translation if it could not be read even after the re-ask
+        """
+        sides = None
+        if "Supported Side" in keys:
+            sides = [debater.name for debater in self.debaters] if self.panel else SIDES
+        ans = self.ask_player(player, verdict=True)
+        try:
+            return self.verdict_parser.parse(ans, keys, required=["debate_translation"], sides=sides)
+        except VerdictError as e:
+            error = e
+        self.verdict_parser.count("repairs")
+        player.add_event(REPAIR_PROMPT.format(error=error, keys=json.dumps(keys)))
+        ans = self.ask_player(player, verdict=True)
+        try:
+            return self.verdict_parser.parse(ans, keys, required=["debate_translation"], sides=sides)
+        except VerdictError:
+            self.verdict_parser.count("repair_failures")
+            return {key: "" for key in keys}
 
     def round_dct(self, num: int):
         dct = {
@@ -173,9 +396,28 @@ class Debate:
         save_file_path = os.path.join(self.save_file_dir, f"{id}.json")
         
         self.save_file['end_time'] = current_time
-        json_str = json.dumps(self.save_file, ensure_ascii=False, indent=4)
-        with open(save_file_path, 'w') as f:
+        json_str = json.dumps(self.export(), ensure_ascii=False, indent=4)
+        # write then rename, so an existing {id}.json is always a finished debate
+        with open(f"{save_file_path}.tmp", 'w') as f:
             f.write(json_str)
+        os.replace(f"{save_file_path}.tmp", save_file_path)
+
+        if self.journal is not None:
+            self.journal.remove()
+
+    def save_file_to_store(self, store: ResultStore, id: int):
+        """Queue the save file in a result store, the journal is removed once it is written
+
+        Args:
+            store (ResultStore): the result store
+            id (int): global id of the input item
+        """
+        self.save_file['end_time'] = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        store.put(id, self.export(), on_written=self.journal.remove if self.journal is not None else None)
+
+    def export(self) -> dict:
+        """The save file with the memories of the players in turbo format, as it is written"""
+        return dict(self.save_file, players={name: to_dicts(memory_lst) for name, memory_lst in self.save_file['players'].items()})
 
     def broadcast(self, msg: str):
         """Broadcast a message to all players. 
@@ -195,84 +437,384 @@ class Debate:
             speaker (str): name of the speaker
             msg (str): the message
         """
+        # the answer itself is shared by every player hearing it
         if not msg.startswith(f"{speaker}: "):
-            msg = f"{speaker}: {msg}"
+            msg = (f"{speaker}: ", msg)
         # print(msg)
         for player in self.players:
             if player.name != speaker:
                 player.add_event(msg)
 
     def ask_and_speak(self, player: DebatePlayer):
-        ans = player.ask()
-        player.add_memory(ans)
+        ans = self.ask_player(player)
         self.speak(player.name, ans)
 
 
     def run(self):
+        judge = None
+        while self.round < self.max_round and self.undecided():
+            if self.speculative_judge and self.round == self.max_round - 1:
+                # the candidates only depend on the first round, extract them while the last round runs
+                judge = self.start_judge()
+            self.play_round()
+        self.conclude(judge)
+
+    def exhausted(self, e: BudgetExceededException):
+        # the debate budget ran out on the way, the debate ends as it is; a run budget stops the debate unsaved instead
+        if e.budget is not self.budget:
+            raise e
+        self.log("budget_exhausted", "===== Debate budget exhausted, stopping the debate =====\n", round=self.round)
+        self.budget_stopped = True
+        self.budget_exhausted = True
+
+    def undecided(self) -> bool:
+        """Whether another round is worth playing, neither decided nor past the soft limit of the budget"""
+        if self.mod_ans["debate_translation"] != '' or self.budget_exhausted:
+            return False
+        if self.budget is not None and self.budget.low():
+            self.log("budget_low", "===== Debate budget low, skipping to the judge =====\n", round=self.round)
+            self.budget_stopped = True
+            return False
+        return True
+
+    def play_round(self):
+        """Play the next round and ask for its verdict"""
+        self.round += 1
+        self.log("round", f"===== Debate Round-{self.round} =====\n", round=self.round)
+        try:
+            if self.panel:
+                for debater in self.debaters:
+                    debater.add_event(self.templates['panel_debate_prompt'].render_parts())
+                self.answers = self.ask_players(self.debaters)
+                self.exchange()
+            else:
+                self.affirmative.add_event(self.templates['debate_prompt'].render_parts(oppo_ans=self.neg_ans))
+                self.aff_ans = self.ask_player(self.affirmative)
 
-        for round in range(self.max_round - 1):
+                self.negative.add_event(self.templates['debate_prompt'].render_parts(oppo_ans=self.aff_ans))
+                self.neg_ans = self.ask_player(self.negative)
 
-            if self.mod_ans["debate_translation"] != '':
-                break
-            else:
-                print(f"===== Debate Round-{round+2} =====\n")
-                self.affirmative.add_event(self.save_file['debate_prompt'].replace('##oppo_ans##', self.neg_ans))
-                self.aff_ans = self.affirmative.ask()
-                self.affirmative.add_memory(self.aff_ans)
+            self.mod_ans = self.moderate(self.round_dct(self.round))
+        except BudgetExceededException as e:
+            self.exhausted(e)
 
-                self.negative.add_event(self.save_file['debate_prompt'].replace('##oppo_ans##', self.aff_ans))
-                self.neg_ans = self.negative.ask()
-                self.negative.add_memory(self.neg_ans)
+    def fork(self, max_round: int, journal: Journal=None) -> "Debate":
+        """Copy of the debate after its current round, which is played on independently
 
-                self.moderator.add_event(self.save_file['moderator_prompt'].replace('##aff_ans##', self.aff_ans).replace('##neg_ans##', self.neg_ans).replace('##round##', self.round_dct(round+2)))
-                self.mod_ans = self.moderator.ask()
-                self.moderator.add_memory(self.mod_ans)
-                self.mod_ans = eval(self.mod_ans)
+        The agents are forked, so the copy shares the messages so far but none that are added later.
+        The copy shares the budget of the debate and records its own turns in its own journal.
+
+        Args:
+            max_round (int): maximum rounds of the copy
+            journal (Journal): journal of the turns of the copy, None for none
 
+        Returns:
+            Debate: the copy
+        """
+        debate = copy.copy(self)
+        debate.max_round = max_round
+        debate.journal = journal
+        debate.save_file = dict(self.save_file, players=dict(self.save_file['players']))
+        debate.players = [player.fork() for player in self.players]
+        for player in debate.players:
+            player.journal = journal
+        debate.debaters = debate.players[:-1]
+        debate.moderator = debate.players[-1]
+        if not self.panel:
+            debate.affirmative = debate.players[0]
+            debate.negative = debate.players[1]
+        return debate
+
+    def conclude(self, judge: "tuple[DebatePlayer, Future]"=None):
+        """Take the verdict of the last round, or ask the judge if there is none, and fill in the save file
+
+        Args:
+            judge (tuple[DebatePlayer, Future]): speculative judge of start_judge, None to start it here if needed
+        """
         if self.mod_ans["debate_translation"] != '':
             self.save_file.update(self.mod_ans)
             self.save_file['success'] = True
 
+        elif self.budget_exhausted:
+            # no budget left for the judge
+            if judge is not None:
+                self.players.append(judge[0])
+
         # ultimate deadly technique.
         else:
-            judge_player = DebatePlayer(model_name=self.model_name, name='Judge', temperature=self.temperature, openai_api_key=self.openai_api_key, sleep_time=self.sleep_time)
-            aff_ans = self.affirmative.memory_lst[2]['content']
-            neg_ans = self.negative.memory_lst[2]['content']
-
-            judge_player.set_meta_prompt(self.save_file['moderator_meta_prompt'])
-
-            # extract answer candidates
-            judge_player.add_event(self.save_file['judge_prompt_last1'].replace('##aff_ans##', aff_ans).replace('##neg_ans##', neg_ans))
-            ans = judge_player.ask()
-            judge_player.add_memory(ans)
-
-            # select one from the candidates
-            judge_player.add_event(self.save_file['judge_prompt_last2'])
-            ans = judge_player.ask()
-            judge_player.add_memory(ans)
-            
-            ans = eval(ans)
-            if ans["debate_translation"] != '':
-                self.save_file['success'] = True
-                # save file
-            self.save_file.update(ans)
+            if judge is None:
+                judge = self.start_judge(background=False)
+            judge_player, candidates = judge
             self.players.append(judge_player)
+            try:
+                # extract answer candidates
+                candidates.result()
+
+                # select one from the candidates
+                judge_player.add_event(self.save_file['judge_prompt_last2'])
+                ans = self.ask_verdict(judge_player, JUDGE_KEYS)
+                if ans["debate_translation"] != '':
+                    self.save_file['success'] = True
+                    # save file
+                self.save_file.update(ans)
+            except BudgetExceededException as e:
+                # the debate is over without a verdict
+                self.exhausted(e)
+        if judge is not None:
+            # an unused speculative answer still has to land in the journal before the debate is saved
+            judge[1].exception()
 
         for player in self.players:
+            player.release()
             self.save_file['players'][player.name] = player.memory_lst
+        if self.budget is not None:
+            self.save_file['budget'] = dict(self.budget.report(), stopped=self.budget_stopped)
+        if self.journal is not None:
+            # nothing is recorded any more, the file buffer is not kept while the debate waits to be saved
+            self.journal.close()
+        if Agent.event_log is not None:
+            Agent.event_log.log("done", "summary", text=f"===== Debate done after round {self.round} =====\n", round=self.round, success=self.save_file['success'], translation=self.save_file.get('debate_translation', ''))
+
+    def start_judge(self, background: bool=True) -> "tuple[DebatePlayer, Future]":
+        """Create the judge and ask it for the candidates of the first round
+
+        Args:
+            background (bool): ask in another thread
+
+        Returns:
+            tuple[DebatePlayer, Future]: the judge and the future of its candidates answer
+        """
+        judge_player = DebatePlayer(model_name=self.model_name, name='Judge', temperature=self.temperature, openai_api_key=self.openai_api_key, sleep_time=self.sleep_time, journal=self.journal, budget=self.budget)
+        judge_player.role = "judge"
+        judge_player.set_meta_prompt(self.save_file['panel_moderator_meta_prompt' if self.panel else 'moderator_meta_prompt'])
+        if self.panel:
+            answers = "\n\n".join(f"{debater.name} arguing: {debater.memory_lst[2]['content']}" for debater in self.debaters)
+            judge_player.add_event(self.templates['panel_judge_prompt_last1'].render(answers=answers))
+        else:
+            aff_ans = self.affirmative.memory_lst[2]['content']
+            neg_ans = self.negative.memory_lst[2]['content']
+            judge_player.add_event(self.templates['judge_prompt_last1'].render_parts(aff_ans=aff_ans, neg_ans=neg_ans))
+
+        # a speculative judge answers along the last round, self.round moves on meanwhile
+        round = self.round + 1 if background else self.round
+        future = Future()
+        def extract():
+            try:
+                future.set_result(self.ask_player(judge_player, round=round))
+            except Exception as e:
+                future.set_exception(e)
+        if background:
+            threading.Thread(target=self.in_debate(extract), daemon=True).start()
+        else:
+            extract()
+        return judge_player, future
 
 
 def parse_args():
     parser = argparse.ArgumentParser("", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
-    parser.add_argument("-i", "--input-file", type=str, required=True, help="Input file path")
+    parser.add_argument("-i", "--input-file", type=str, required=True, help="Input file path, tsv of source and reference or jsonl")
+    parser.add_argument("--input-format", type=str, default=None, choices=FORMATS, help="Input format, guessed from the extension if not given")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="Only run the items i/n of the input, the line ids with id %% n == i")
+    parser.add_argument("--offset", type=int, default=0, help="First input line to run")
+    parser.add_argument("--limit", type=int, default=None, help="Number of input lines to run from the offset")
     parser.add_argument("-o", "--output-dir", type=str, required=True, help="Output file dir")
     parser.add_argument("-lp", "--lang-pair", type=str, required=True, help="Language pair")
-    parser.add_argument("-k", "--api-key", type=str, required=True, help="OpenAI api key")
-    parser.add_argument("-m", "--model-name", type=str, default="gpt-3.5-turbo", help="Model name")
-    parser.add_argument("-t", "--temperature", type=float, default=0, help="Sampling temperature")
+    parser.add_argument("-k", "--api-key", type=str, default=None, help="OpenAI api key")
+    parser.add_argument("--key-file", type=str, default=None, help="File with one OpenAI api key per line, calls are balanced across them")
+    parser.add_argument("-m", "--model-name", type=str, nargs="+", default=["gpt-3.5-turbo"], help="Model name, several to sweep over them")
+    parser.add_argument("-t", "--temperature", type=float, nargs="+", default=[0], help="Sampling temperature, several to sweep over them")
+    parser.add_argument("--max-round", type=int, nargs="+", default=[3], help="Maximum rounds of debate, several to sweep over them; the rounds they share are played once")
+    parser.add_argument("-n", "--num-players", type=int, default=3, help="Number of players including the moderator, more than 3 for a panel of debaters answering concurrently")
+    parser.add_argument("--speculative-judge", action="store_true", help="Ask the judge for the candidates while the last round runs")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="Number of debates in flight at the same time")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute allowed for each model and key")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute allowed for each model and key")
+    parser.add_argument("--backend", type=str, default="openai", choices=["openai", "replay", "mock"], help="Where chat requests go")
+    parser.add_argument("--api-base", type=str, default=None, help="Base url of an openai compatible server, e.g. utils.mock_server")
+    parser.add_argument("--pool-size", type=int, default=32, help="Keep-alive connections to the api shared by all agents")
+    parser.add_argument("--connect-timeout", type=float, default=10, help="Seconds to connect to the api")
+    parser.add_argument("--read-timeout", type=float, default=600, help="Seconds to wait for the next bytes of an api response")
+    parser.add_argument("--pool-timeout", type=float, default=60, help="Seconds an api request waits for a free pooled connection before it is retried")
+    parser.add_argument("--http2", action="store_true", help="Send api requests over HTTP/2, needs httpx[http2]")
+    parser.add_argument("--replay-dir", type=str, default=None, help="Transcript dir served by the replay backend")
+    parser.add_argument("--mock-latency", type=float, default=0, help="Seconds per request of the replay and mock backends")
+    parser.add_argument("--stream", action="store_true", help="Stream answers and stop reading moderator verdicts once decided")
+    parser.add_argument("--keep-last", type=int, default=None, help="Send only the last N messages verbatim and fold older ones into summaries, off if not given")
+    parser.add_argument("--summary-tokens", type=int, default=80, help="Token budget of the summary of one folded message")
+    parser.add_argument("--consensus-threshold", type=float, default=None, help="Skip the moderator when the candidates of both sides are at least this similar (1.0 for equal), off if not given")
+    parser.add_argument("--trace", type=str, default=None, help="Append a span per agent query and a summary per debate to this jsonl file")
+    parser.add_argument("--metrics", type=str, default=None, help="Prometheus textfile with the totals per agent role, rewritten after every debate")
+    parser.add_argument("--log-level", type=str, default="full", choices=["off", "summary", "full"], help="Events logged: none, rounds and finished debates, or also every message")
+    parser.add_argument("--log-file", type=str, default=None, help="Write the events as jsonl to this file instead of stdout")
+    parser.add_argument("--log-max-bytes", type=int, default=64 << 20, help="Size at which the log file is rotated")
+    parser.add_argument("--log-backups", type=int, default=5, help="Rotated log files kept")
+    parser.add_argument("--debate-max-tokens", type=int, default=None, help="Token budget of one debate, past 80%% of it the debate goes straight to the judge")
+    parser.add_argument("--debate-max-cost", type=float, default=None, help="Dollar budget of one debate")
+    parser.add_argument("--run-max-tokens", type=int, default=None, help="Token budget of the run, past 80%% of it no new debate is started")
+    parser.add_argument("--run-max-cost", type=float, default=None, help="Dollar budget of the run")
+    parser.add_argument("--cap-completions", action="store_true", help="Bound max_tokens of each role by the answer lengths observed so far")
+    parser.add_argument("--store", type=str, default=None, help="Append results to a compressed result store in this dir instead of one {id}.json per input")
+    parser.add_argument("--save-config", action="store_true", help="Also write the prompts of every input to {id}-config.json")
+    parser.add_argument("--batch-base", type=str, default=None, choices=["local", "openai"], help="Ask the base translations as batch jobs before the debates, local runs them through the backend from job files")
+    parser.add_argument("--batch-dir", type=str, default=None, help="Job dir of the local batch runner, {output_dir}/batch if not given")
+    parser.add_argument("--batch-size", type=int, default=50000, help="Items per batch job")
+    parser.add_argument("--batch-poll", type=float, default=None, help="Seconds between two status checks of a batch job, 30 for openai and 0.5 for local if not given")
+    parser.add_argument("--cache-path", type=str, default=None, help="Sqlite file caching api responses, off if not given")
+    parser.add_argument("--cache-max-entries", type=int, default=None, help="Max number of cached responses")
+    parser.add_argument("--cache-max-age", type=float, default=None, help="Max age of cached responses in seconds")
+
+    args = parser.parse_args()
+    if args.keep_last is not None and args.keep_last < 1:
+        parser.error("--keep-last must be at least 1, the last message is the prompt of the query")
+    return args
+
+
+class DebateFactory:
+    def __init__(self, config: dict, save_file_dir: str, openai_api_key: str, model_name: str='gpt-3.5-turbo', temperature: float=0, stream: bool=False, save_config: bool=False, max_tokens: int=None, max_cost: float=None, num_players: int=3, speculative_judge: bool=False, max_round: int=3) -> None:
+        """Build debates from input items, the prompt templates of the config are checked and compiled once
 
-    return parser.parse_args()
+        Args:
+            config (dict): translation config with src_lng and tgt_lng set, it is not modified
+            save_file_dir (str): dir path to json file
+            openai_api_key (str): As the parameter name suggests
+            model_name (str): openai model name
+            temperature (float): sampling temperature
+            stream (bool): stream the answers
+            save_config (bool): also write the config of every item to {id}-config.json
+            max_tokens (int): token budget of every debate, None for no limit
+            max_cost (float): cost budget of every debate in dollars, None for no limit
+            num_players (int): num of players, more than 3 for a panel of debaters
+            speculative_judge (bool): extract the judge's candidates during the last round
+            max_round (int): maximum rounds of every debate
+        """
+        self.config = config
+        self.templates = compile_templates(config, dict(TEMPLATE_FIELDS, **PANEL_TEMPLATE_FIELDS) if num_players > 3 else TEMPLATE_FIELDS)
+        self.save_file_dir = save_file_dir
+        self.openai_api_key = openai_api_key
+        self.model_name = model_name
+        self.temperature = temperature
+        self.stream = stream
+        self.save_config = save_config
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.num_players = num_players
+        self.speculative_judge = speculative_judge
+        self.max_round = max_round
+
+    def create(self, id: int, input: dict, max_round: int=None) -> Debate:
+        """Build the debate of one input item, its first round is played while building
+
+        Args:
+            id (int): global id of the input item
+            input (dict): {"source": ..., "reference": ...} item of read_corpus
+            max_round (int): maximum rounds, that of the factory if not given
+
+        Returns:
+            Debate: the debate
+        """
+        config = dict(self.config, source=input['source'], reference=input['reference'])
+        if self.save_config:
+            with open(f"{self.save_file_dir}/{id}-config.json", 'w') as file:
+                json.dump(config, file, ensure_ascii=False, indent=4)
+
+        journal = Journal(self.journal_path(id))
+        budget = Budget("debate", max_tokens=self.max_tokens, max_cost=self.max_cost) if self.max_tokens or self.max_cost else None
+        return Debate(model_name=self.model_name, save_file_dir=self.save_file_dir, num_players=self.num_players, openai_api_key=self.openai_api_key, temperature=self.temperature, sleep_time=0, journal=journal, stream=self.stream, speculative_judge=self.speculative_judge, config=config, templates=self.templates, budget=budget, max_round=max_round or self.max_round)
+
+    def journal_path(self, id: int, max_round: int=None) -> str:
+        # a fork of a sweep journals the turns it plays on its own
+        if max_round is not None:
+            return f"{self.save_file_dir}/{id}.r{max_round}.journal.jsonl"
+        return f"{self.save_file_dir}/{id}.journal.jsonl"
+
+    def base_request(self, custom_id: str, input: dict) -> dict:
+        """The base translation request of one input item, for a batch job
+
+        Args:
+            custom_id (str): id the answer is returned under
+            input (dict): {"source": ..., "reference": ...} item of read_corpus
+
+        Returns:
+            dict: the request of batch_request
+        """
+        prompt = self.templates['base_prompt'].render(dict(self.config, source=input['source'], reference=input['reference']))
+        max_tokens = model2max_context[self.model_name] - num_tokens_from_string(prompt, self.model_name)
+        return batch_request(custom_id, self.model_name, [{"role": "user", "content": prompt}], self.temperature, max_tokens)
+
+    def run(self, id: int, input: dict) -> Debate:
+        """Run the whole debate of one input item
+
+        Args: same as create
+
+        Returns:
+            Debate: the finished debate
+        """
+        return self.sweep(id, input, [self.max_round])[self.max_round]
+
+    def sweep(self, id: int, input: dict, max_rounds: "list[int]") -> "dict[int, Debate]":
+        """Run the debate of one input item for several maximum rounds, playing the rounds they share once
+
+        The debate is played up to the largest max_round; where a smaller one ends, a fork of the debate
+        concludes on its own, so only its verdict or judge is asked on top of the shared rounds.
+
+        Args:
+            id (int): global id of the input item
+            input (dict): {"source": ..., "reference": ...} item of read_corpus
+            max_rounds (list[int]): maximum rounds to run
+
+        Returns:
+            dict[int, Debate]: max_round -> finished debate
+        """
+        max_rounds = sorted(set(max_rounds))
+        tracing = Agent.tracer.context(id) if Agent.tracer is not None else contextlib.nullcontext()
+        logging = Agent.event_log.context(id) if Agent.event_log is not None else contextlib.nullcontext()
+        debates = {}
+        with tracing, logging:
+            debate = self.create(id, input, max_round=max_rounds[-1])
+            for max_round in max_rounds[:-1]:
+                while debate.round < max_round and debate.undecided():
+                    debate.play_round()
+                debates[max_round] = debate.fork(max_round, journal=Journal(self.journal_path(id, max_round)))
+                debates[max_round].run()
+            debate.run()
+            debates[max_rounds[-1]] = debate
+        return debates
+
+
+def batch_base_translations(runner: BatchRunner, factories: "list[DebateFactory]", items: "list[tuple]", poll_interval: float=30):
+    """Ask the base translations of many input items as one batch job
+
+    The answers are written to the journals of the debates, which replay them instead of asking.
+    Items whose journal already has a base translation are not asked again, failed requests are
+    left to the debate to ask.
+
+    Args:
+        runner (BatchRunner): runs the batch job
+        factories (list[DebateFactory]): factories of the debates, one request per factory and item
+        items (list[tuple]): (id, input) items of read_corpus
+        poll_interval (float): seconds between two status checks of the job
+    """
+    requests, targets = [], {}
+    for i, factory in enumerate(factories):
+        for id, input in items:
+            path = factory.journal_path(id)
+            if os.path.exists(path) and any(entry["agent"] == "Baseline" for entry in Journal(path).entries):
+                continue
+            custom_id = f"{i}-{id}"
+            requests.append(factory.base_request(custom_id, input))
+            targets[custom_id] = (factory, id, requests[-1]["body"]["messages"][0]["content"])
+    answers = runner.run(requests, poll_interval=poll_interval)
+    print(f"batch: {len(answers)} of {len(requests)} base translations")
+    for custom_id, body in answers.items():
+        factory, id, prompt = targets[custom_id]
+        ans = body["choices"][0]["message"]["content"]
+        journal = Journal(factory.journal_path(id))
+        journal.record("Baseline", ans)
+        journal.close()
+        if Agent.run_budget is not None:
+            usage = body.get("usage") or {"prompt_tokens": num_tokens_from_string(prompt, factory.model_name), "completion_tokens": num_tokens_from_string(ans, factory.model_name)}
+            Agent.run_budget.charge(factory.model_name, usage["prompt_tokens"], usage["completion_tokens"])
 
 
 if __name__ == "__main__":
@@ -287,30 +829,130 @@ if __name__ == "__main__":
     tgt_full = Language.make(language=tgt_lng).display_name()
 
     config = json.load(open(f"{MAD_path}/code/utils/config4tran.json", "r"))
-
-    inputs = open(args.input_file, "r").readlines()
-    inputs = [l.strip() for l in inputs]
+    config['src_lng'] = src_full
+    config['tgt_lng'] = tgt_full
+
+    if args.backend == "replay":
+        Agent.backend = ReplayBackend(args.replay_dir or f"{MAD_path}/data/CommonMT/Lexical_Ambiguity/MAD_Debate_Process", latency=args.mock_latency)
+    elif args.backend == "mock":
+        Agent.backend = MockBackend(latency=args.mock_latency)
+    else:
+        Agent.backend = OpenAIBackend(api_base=args.api_base, client=HTTPClient(pool_size=args.pool_size, connect_timeout=args.connect_timeout, read_timeout=args.read_timeout, http2=args.http2, pool_timeout=args.pool_timeout))
+    if args.rpm or args.tpm:
+        Agent.rate_limiter = RateLimiter(rpm=args.rpm, tpm=args.tpm)
+    if args.key_file:
+        Agent.key_pool = KeyPool.from_file(args.key_file, rate_limiter=Agent.rate_limiter)
+    elif os.environ.get("OPENAI_API_KEYS"):
+        Agent.key_pool = KeyPool.from_env("OPENAI_API_KEYS", rate_limiter=Agent.rate_limiter)
+    elif not openai_api_key and args.backend == "openai":
+        raise ValueError("Give an api key with -k, --key-file or the OPENAI_API_KEYS environment variable")
+    if args.keep_last is not None:
+        Agent.memory_policy = MemoryPolicy(keep_last=args.keep_last, summary_tokens=args.summary_tokens)
+    # messages and banners are written by a background thread, off the critical path of the debates
+    Agent.event_log = EventLog(args.log_file, level=args.log_level, max_bytes=args.log_max_bytes, backups=args.log_backups)
+    if args.trace or args.metrics:
+        Agent.tracer = Tracer(args.trace, prometheus_path=args.metrics)
+    if args.run_max_tokens or args.run_max_cost:
+        Agent.run_budget = Budget("run", max_tokens=args.run_max_tokens, max_cost=args.run_max_cost)
+    if args.cap_completions:
+        Agent.completion_caps = CompletionCaps()
+    if args.consensus_threshold is not None:
+        Debate.consensus = ConsensusDetector(threshold=args.consensus_threshold)
+    if args.cache_path:
+        Agent.response_cache = ResponseCache(args.cache_path, max_entries=args.cache_max_entries, max_age=args.cache_max_age)
 
     save_file_dir = args.output_dir
-    if not os.path.exists(save_file_dir):
-            os.mkdir(save_file_dir)
-
-    for id, input in enumerate(tqdm(inputs)):
-        # files = os.listdir(save_file_dir)
-        # if f"{id}.json" in files:
-        #     continue
-
-        prompts_path = f"{save_file_dir}/{id}-config.json"
-
-        config['source'] = input.split('\t')[0]
-        config['reference'] = input.split('\t')[1]
-        config['src_lng'] = src_full
-        config['tgt_lng'] = tgt_full
-
-        with open(prompts_path, 'w') as file:
-            json.dump(config, file, ensure_ascii=False, indent=4)
-
-        debate = Debate(save_file_dir=save_file_dir, num_players=3, openai_api_key=openai_api_key, prompts_path=prompts_path, temperature=0, sleep_time=0)
-        debate.run()
-        debate.save_file_to_json(id)
-
+    # a single configuration writes to the output dir, a sweep to one sub dir per configuration
+    variants = [(model_name, temperature, max_round) for model_name in args.model_name for temperature in args.temperature for max_round in sorted(set(args.max_round))]
+    def variant_dir(root, model_name, temperature, max_round):
+        return root if len(variants) == 1 else os.path.join(root, f"{model_name}_t{temperature:g}_r{max_round}")
+    for variant in variants:
+        os.makedirs(variant_dir(save_file_dir, *variant), exist_ok=True)
+
+    # finished debates are skipped, partially finished ones resume from their journal
+    stores = {variant: ResultStore(variant_dir(args.store, *variant)) for variant in variants} if args.store else None
+    if stores is not None:
+        finished = lambda id: all(id in store for store in stores.values())
+    else:
+        files = {variant: set(os.listdir(variant_dir(save_file_dir, *variant))) for variant in variants}
+        finished = lambda id: all(f"{id}.json" in names for names in files.values())
+    inputs = read_corpus(args.input_file, shard=args.shard, offset=args.offset, limit=args.limit, format=args.input_format)
+    items = ((id, input) for id, input in inputs if not finished(id))
+    if Agent.run_budget is not None:
+        # unstarted and interrupted debates are left for a later run
+        items = itertools.takewhile(lambda item: not Agent.run_budget.low(), items)
+
+    # debates of one model and temperature share their rounds, the longest one keeps the journal
+    max_round = max(args.max_round)
+    factories = {
+        (model_name, temperature): DebateFactory(config, variant_dir(save_file_dir, model_name, temperature, max_round), openai_api_key, model_name=model_name, temperature=temperature, stream=args.stream, save_config=args.save_config, max_tokens=args.debate_max_tokens, max_cost=args.debate_max_cost, num_players=args.num_players, speculative_judge=args.speculative_judge, max_round=max_round)
+        for model_name in args.model_name for temperature in args.temperature
+    }
+
+    if args.batch_base:
+        # the base translations of a chunk of items are asked as one batch job before their debates start
+        if args.batch_base == "local":
+            runner = LocalBatchRunner(args.batch_dir or os.path.join(save_file_dir, "batch"), Agent.backend, concurrency=max(8, args.concurrency), agent_name="Baseline")
+        else:
+            runner = OpenAIBatchRunner(openai_api_key or Agent.key_pool.keys[0], api_base=args.api_base)
+        def staged(items):
+            items = iter(items)
+            while True:
+                chunk = list(itertools.islice(items, args.batch_size))
+                if not chunk:
+                    return
+                batch_base_translations(runner, list(factories.values()), chunk, poll_interval=args.batch_poll or (0.5 if args.batch_base == "local" else 30))
+                yield from chunk
+        items = staged(items)
+
+    def worker(item):
+        id, input = item
+        try:
+            return id, {
+                (model_name, temperature, max_round): debate
+                for (model_name, temperature), factory in factories.items()
+                for max_round, debate in factory.sweep(id, input, args.max_round).items()
+            }
+        except BudgetExceededException as e:
+            print(f"debate {id} stopped: {e}")
+            return id, None
+
+    # debates run concurrently, but results are saved in input order
+    for id, debates in tqdm(ordered_map(worker, items, concurrency=args.concurrency)):
+        if debates is None:
+            continue
+        # the longest debate of a sweep comes last, its journal is removed once all of them are saved
+        for variant, debate in sorted(debates.items()):
+            if stores is not None:
+                debate.save_file_to_store(stores[variant], id)
+            else:
+                debate.save_file_dir = variant_dir(save_file_dir, *variant)
+                debate.save_file_to_json(id)
+    if stores is not None:
+        for store in stores.values():
+            store.close()
+    Agent.event_log.close()
+    if Agent.event_log.dropped:
+        print(f"event log: {Agent.event_log.dropped} events dropped")
+
+    if Agent.rate_limiter is not None:
+        for bucket, stats in Agent.rate_limiter.report().items():
+            print(f"rate limiter {bucket}: {stats}")
+    if Agent.key_pool is not None:
+        for key, stats in Agent.key_pool.report().items():
+            print(f"api key {key}: {stats}")
+    if getattr(Agent.backend, "client", None) is not None:
+        print(f"http client: {Agent.backend.client.report()}")
+        Agent.backend.client.close()
+    if Agent.response_cache is not None:
+        print(f"response cache: {Agent.response_cache.stats()}")
+    print(f"verdicts: {Debate.verdict_parser.report()}")
+    if Agent.run_budget is not None:
+        print(f"run budget: {Agent.run_budget.report()}")
+    if Agent.completion_caps is not None:
+        print(f"completion caps: {Agent.completion_caps.report()}")
+    if Agent.tracer is not None:
+        print(f"trace: {Agent.tracer.summary()['total']}")
+        Agent.tracer.close()
+    if Debate.consensus is not None:
+        print(f"consensus: {Debate.consensus.report()}")
@@ -0,0 +1,188 @@
+"""
+Parallel evaluation of debate outputs.
+
+Loads result directories (one json per input, such as MAD_Debate_Process or the output of debate4tran.py),
+result stores (--store) and plain system outputs (one translation per line) in worker processes, scores
+CIAR answers against the gold and incorrect answers of CIAR.json and CommonMT translations with corpus
+BLEU and chrF against the reference, and prints accuracy tables per result path, model and number of rounds.
+
+    python3 code/evaluate.py data/CommonMT/Lexical_Ambiguity/MAD_Debate_Process results/ -j 8 --report eval.json
+    python3 code/evaluate.py data/CommonMT/Lexical_Ambiguity/output/* --references data/CommonMT/Lexical_Ambiguity/raw/lexical.zh-en.en
+"""
+
+
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from utils.result_store import ResultStore
+from utils.scoring import judge_answer, normalize_answer, bleu_stats, chrf_stats, corpus_bleu, corpus_chrf, sum_stats
+
+MAD_path = os.path.abspath(__file__).rsplit("/", 2)[0]
+
+# players that do not debate, their answers are not rounds
+NON_DEBATERS = {"Baseline", "Moderator", "Judge"}
+
+# normalized CIAR question -> item, loaded once per worker
+GOLD = {}
+
+
+def load_gold(ciar_path: str):
+    for item in json.load(open(ciar_path, "r")):
+        GOLD[normalize_answer(item["question"])] = item
+
+
+def count_rounds(players: dict) -> int:
+    # the fewest answers of a debater, the affirmative side of older transcripts also gave the base translation
+    return min([sum(message["role"] == "assistant" for message in memory_lst) for name, memory_lst in players.items() if name not in NON_DEBATERS], default=0)
+
+
+def score_record(record: dict, model: str=None) -> dict:
+    """Score one debate
+
+    Args:
+        record (dict): saved debate, of debate4tran.py (CommonMT) or of interactive.py / service.py --output-dir (CIAR)
+        model (str): model name if the record has none
+
+    Returns:
+        dict: compact row with the per-sentence statistics, None if the record is neither task
+    """
+    row = {"model": record.get("model_name", model), "rounds": count_rounds(record.get("players", {}))}
+    if "debate_topic" in record or "question" in record:
+        item = GOLD.get(normalize_answer(record.get("debate_topic", record.get("question", ""))))
+        if item is None:
+            return None
+        row["task"] = "ciar"
+        for side, key in (("base", "base_answer"), ("debate", "debate_answer")):
+            row[side] = judge_answer(str(record.get(key, "")), item["answer"], item["incorrect answer"])
+        return row
+    reference = record.get("reference") or record.get("correct reference")
+    if not reference:
+        return None
+    row["task"] = "commonmt"
+    incorrect = record.get("incorrect reference")
+    for side, keys in (("base", ("base_translation", "base translation")), ("debate", ("debate_translation", "debate translation"))):
+        hypothesis = next((record[key] for key in keys if record.get(key)), None)
+        if hypothesis is None:
+            continue
+        row[side] = {"bleu": bleu_stats(hypothesis, reference), "chrf": chrf_stats(hypothesis, reference)}
+        if incorrect:
+            # the lexical sense is right if the translation is closer to the correct than to the incorrect reference
+            row[side]["sense"] = corpus_chrf(row[side]["chrf"]) > corpus_chrf(chrf_stats(hypothesis, incorrect))
+    return row
+
+
+def score_chunk(job: tuple) -> "list[dict]":
+    """Score a chunk of results in a worker process
+
+    Args:
+        job (tuple): ("json", paths), ("store", path, ids) or ("text", path, references)
+
+    Returns:
+        list[dict]: rows of score_record, labelled with the path they come from
+    """
+    kind, path, arg = job
+    if kind == "json":
+        rows = []
+        for file in arg:
+            with open(file, "r") as f:
+                rows.append(score_record(json.load(f)))
+    elif kind == "store":
+        store = ResultStore(path)
+        rows = [score_record(store.get(id)) for id in arg]
+        store.close()
+    else:
+        model = os.path.basename(path.rstrip("/"))
+        with open(path, "r") as f:
+            hypotheses = f.read().splitlines()
+        rows = [score_record({"reference": reference, "debate_translation": hypothesis}, model=model) for hypothesis, reference in zip(hypotheses, arg)]
+    # runs of the same model are kept apart by their path
+    run = path.rstrip("/")
+    return [dict(row, run=run) for row in rows if row is not None]
+
+
+def plan_jobs(paths: "list[str]", references: "list[str]", chunk_size: int) -> "list[tuple]":
+    jobs = []
+    for path in paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} does not exist")
+        if os.path.exists(os.path.join(path, "index.jsonl")):
+            ids = ResultStore(path).ids()
+            jobs += [("store", path, ids[i:i + chunk_size]) for i in range(0, len(ids), chunk_size)]
+        elif os.path.isdir(path):
+            files = sorted(os.path.join(path, file) for file in os.listdir(path) if file.endswith(".json") and not file.endswith("-config.json"))
+            jobs += [("json", path, files[i:i + chunk_size]) for i in range(0, len(files), chunk_size)]
+        else:
+            if references is None:
+                raise ValueError(f"{path} is a plain system output, give its reference translations with --references")
+            jobs.append(("text", path, references))
+    return jobs
+
+
+def aggregate(rows: "list[dict]") -> "dict[str, dict]":
+    """Accuracy, BLEU and chrF per task, result path, model and number of rounds ("all" for every round)
+
+    Returns:
+        dict[str, dict]: task -> "run / model / rounds" -> scores
+    """
+    groups = {}
+    for row in rows:
+        for rounds in (row["rounds"], "all"):
+            groups.setdefault(row["task"], {}).setdefault((row.get("run", ""), str(row["model"]), str(rounds)), []).append(row)
+    tables = {}
+    for task, task_groups in groups.items():
+        table = tables[task] = {}
+        for (run, model, rounds), group in sorted(task_groups.items(), key=lambda kv: (kv[0][0], kv[0][1], kv[0][2] == "all", kv[0][2].zfill(4))):
+            scores = {"n": len(group)}
+            for side in ("base", "debate"):
+                sided = [row[side] for row in group if side in row]
+                if not sided:
+                    continue
+                if task == "ciar":
+                    scores[f"{side}_acc"] = 100 * sum(sided) / len(sided)
+                    continue
+                scores[f"{side}_bleu"] = corpus_bleu(sum_stats([stats["bleu"] for stats in sided]))
+                scores[f"{side}_chrf"] = corpus_chrf(sum_stats([stats["chrf"] for stats in sided]))
+                senses = [stats["sense"] for stats in sided if "sense" in stats]
+                if senses:
+                    scores[f"{side}_sense"] = 100 * sum(senses) / len(senses)
+            table[f"{run} / {model} / {rounds}"] = scores
+    return tables
+
+
+def print_table(task: str, table: "dict[str, dict]"):
+    columns = ["n"] + sorted({column for scores in table.values() for column in scores} - {"n"}, key=lambda c: (c.split("_")[1], c))
+    width = max([len("run / model / rounds")] + [len(name) for name in table])
+    print(f"\n===== {task} =====")
+    print("run / model / rounds".ljust(width) + "".join(column.rjust(13) for column in columns))
+    for name, scores in table.items():
+        cells = [f"{scores[column]:.2f}" if isinstance(scores.get(column), float) else str(scores.get(column, "-")) for column in columns]
+        print(name.ljust(width) + "".join(cell.rjust(13) for cell in cells))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("paths", type=str, nargs="+", help="result directories, result stores or plain system outputs")
+    parser.add_argument("--references", type=str, default=None, help="reference translations, one per line, for plain system outputs")
+    parser.add_argument("--ciar", type=str, default=f"{MAD_path}/data/CounterintuitiveQA/CIAR.json", help="CIAR questions with gold and incorrect answers")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=128, help="results scored per worker task")
+    parser.add_argument("--report", type=str, default=None, help="write the tables as json")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    references = open(args.references, "r").read().splitlines() if args.references else None
+    jobs = plan_jobs(args.paths, references, args.chunk_size)
+
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=load_gold, initargs=(args.ciar,)) as pool:
+        rows = [row for chunk in pool.map(score_chunk, jobs) for row in chunk]
+
+    tables = aggregate(rows)
+    for task, table in tables.items():
+        print_table(task, table)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(tables, f, indent=4)
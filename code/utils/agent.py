@@ -1,14 +1,34 @@
-import openai
 import backoff
+import copy
 import time
 import random
+import itertools
 from openai.error import RateLimitError, APIError, ServiceUnavailableError, APIConnectionError
 from .openai_utils import OutOfQuotaException, AccessTerminatedException
 from .openai_utils import num_tokens_from_string, model2max_context
-
-support_models = ['gpt-3.5-turbo', 'gpt-3.5-turbo-0301', 'gpt-4', 'gpt-4-0314']
+from .backends import OpenAIBackend, support_models
+from .message import Message, to_dicts
 
 class Agent:
+    # process-wide Backend every query goes through
+    backend = OpenAIBackend()
+    # process-wide RateLimiter shared by every agent, set it once before the debates start
+    rate_limiter = None
+    # opt-in process-wide ResponseCache, responses are looked up before any api call
+    response_cache = None
+    # opt-in process-wide KeyPool, replaces the api key of the agent when set
+    key_pool = None
+    # opt-in process-wide Tracer recording a span for every query
+    tracer = None
+    # opt-in process-wide Budget of the whole run
+    run_budget = None
+    # opt-in process-wide CompletionCaps bounding max_tokens per role
+    completion_caps = None
+    # opt-in MemoryPolicy compacting the memory sent with each query, memory_lst itself always keeps the full history
+    memory_policy = None
+    # opt-in process-wide EventLog the messages go to instead of print
+    event_log = None
+
     def __init__(self, model_name: str, name: str, temperature: float, sleep_time: float=0) -> None:
         """Create an agent
 
@@ -16,16 +36,33 @@ class Agent:
             model_name(str): model name
             name (str): name of this agent
             temperature (float): higher values make the output more random, while lower values make it more focused and deterministic
-            sleep_time (float): sleep because of rate limits
+            sleep_time (float): sleep because of rate limits, only used when no rate_limiter is set
         """
         self.model_name = model_name
         self.name = name
         self.temperature = temperature
+        # Message objects, read like the dicts of the turbo format
         self.memory_lst = []
+        # token count of every message in memory_lst and their running total, so ask() never re-tokenizes
+        self.memory_tokens = []
+        self.num_context_token = 0
+        self.num_answers = 0
         self.sleep_time = sleep_time
+        # Journal of the debate this agent plays in, answers are replayed from it before asking the api
+        self.journal = None
+        # seconds until the first piece of the last streamed answer arrived
+        self.time_to_first_token = None
+        # role reported in traces, the name if not set
+        self.role = None
+        # span of the query in progress, only set when a tracer is
+        self.span = None
+        # Budget of the debate this agent plays in, None for no limit
+        self.budget = None
+        # whether the last answer came from the response cache
+        self.cached = False
 
-    @backoff.on_exception(backoff.expo, (RateLimitError, APIError, ServiceUnavailableError, APIConnectionError), max_tries=20)
-    def query(self, messages: "list[dict]", max_tokens: int, api_key: str, temperature: float) -> str:
+    @backoff.on_exception(backoff.expo, (RateLimitError, APIError, ServiceUnavailableError, APIConnectionError), max_tries=20, on_backoff=lambda details: details["args"][0]._on_backoff(details))
+    def query(self, messages: "list[dict]", max_tokens: int, api_key: str, temperature: float, num_tokens: int=0) -> str:
         """make a query
 
         Args:
@@ -33,68 +70,252 @@ class Agent:
             max_tokens (int): max token in api call
             api_key (str): openai api key
             temperature (float): sampling temperature
+            num_tokens (int): prompt tokens of messages, charged to the rate limiter
 
         Raises:
             OutOfQuotaException: the apikey has out of quota
             AccessTerminatedException: the apikey has been ban
+            NoAvailableKeyException: every key of the key pool has been retired
 
         Returns:
             str: the return msg
         """
-        time.sleep(self.sleep_time)
-        assert self.model_name in support_models, f"Not support {self.model_name}. Choices: {support_models}"
+        if self.response_cache is not None:
+            cache_key = self.response_cache.make_key(self.model_name, messages, temperature, max_tokens)
+            gen = self.response_cache.get(cache_key)
+            if gen is not None:
+                self.cached = True
+                if self.span is not None:
+                    self.span["cached"] = True
+                return gen
+
+        gen = self._call_backend(
+            lambda key: self.backend.chat(self.model_name, messages, temperature, max_tokens, key, agent_name=self.name, turn=self.num_answers),
+            api_key, num_tokens
+        )
+        if self.response_cache is not None:
+            self.response_cache.put(cache_key, gen)
+        return gen
+
+    @backoff.on_exception(backoff.expo, (RateLimitError, APIError, ServiceUnavailableError, APIConnectionError), max_tries=20, on_backoff=lambda details: details["args"][0]._on_backoff(details))
+    def _open_stream(self, messages: "list[dict]", max_tokens: int, api_key: str, temperature: float, num_tokens: int=0):
+        # retries are only possible until the first piece arrived
+        def open_stream(key):
+            stream = self.backend.chat_stream(self.model_name, messages, temperature, max_tokens, key, agent_name=self.name, turn=self.num_answers)
+            return next(stream, ""), stream
+        return self._call_backend(open_stream, api_key, num_tokens)
+
+    def _call_backend(self, call, api_key: str, num_tokens: int):
+        # run call(api_key) once admitted; with a key pool the key is chosen per call and
+        # keys out of quota or terminated are retired and the call moves to the next key
+        assert self.backend.supports(self.model_name), f"{type(self.backend).__name__} does not support {self.model_name}. Choices: {support_models}"
+        while True:
+            if self.key_pool is not None:
+                api_key = self.key_pool.acquire(self.model_name, num_tokens)
+            failed = False
+            try:
+                start = time.perf_counter()
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire(self.model_name, api_key, num_tokens)
+                else:
+                    time.sleep(self.sleep_time)
+                if self.span is not None:
+                    self.span["sleep_time"] += time.perf_counter() - start
+                    start = time.perf_counter()
+                try:
+                    return call(api_key)
+                finally:
+                    if self.span is not None:
+                        self.span["api_time"] += time.perf_counter() - start
+            except (OutOfQuotaException, AccessTerminatedException) as e:
+                failed = True
+                if self.key_pool is None:
+                    raise e
+                self.key_pool.retire(api_key, e)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                if self.key_pool is not None:
+                    self.key_pool.release(api_key, failed=failed)
+
+    def _on_backoff(self, details: dict):
+        if self.span is not None:
+            self.span["retries"] += 1
+            self.span["backoff_time"] += details["wait"]
+
+    def query_stream(self, messages: "list[dict]", max_tokens: int, api_key: str, temperature: float, num_tokens: int=0, until=None):
+        """make a query and yield the answer as it is generated
+
+        Args: same as query, and
+            until (callable): called with every piece once it was read, the stream stops once it returns True
+
+        Yields:
+            str: the next piece of the return msg
+        """
+        if self.response_cache is not None:
+            cache_key = self.response_cache.make_key(self.model_name, messages, temperature, max_tokens)
+            keys = [cache_key]
+            if until is not None:
+                # an earlier stream of the request may have been stopped by until, e.g. at the end of a verdict
+                partial_key = self.response_cache.make_key(self.model_name, messages, temperature, max_tokens, partial=True)
+                keys.insert(0, partial_key)
+            for key in keys:
+                gen = self.response_cache.get(key, count_miss=key is keys[-1])
+                if gen is not None:
+                    self.cached = True
+                    if self.span is not None:
+                        self.span["cached"] = True
+                    yield gen
+                    if until is not None:
+                        until(gen)
+                    return
+
+        first, stream = self._open_stream(messages, max_tokens, api_key, temperature, num_tokens=num_tokens)
+        pieces = []
+        stopped = False
+        start = time.perf_counter()
         try:
-            if self.model_name in support_models:
-                response = openai.ChatCompletion.create(
-                    model=self.model_name,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    api_key=api_key,
-                )
-                gen = response['choices'][0]['message']['content']
-            return gen
-
-        except RateLimitError as e:
-            if "You exceeded your current quota, please check your plan and billing details" in e.user_message:
-                raise OutOfQuotaException(api_key)
-            elif "Your access was terminated due to violation of our policies" in e.user_message:
-                raise AccessTerminatedException(api_key)
-            else:
-                raise e
+            for delta in itertools.chain([first], stream):
+                pieces.append(delta)
+                yield delta
+                if until is not None and until(delta):
+                    stopped = True
+                    break
+        finally:
+            # also reached when the caller stops reading early, which cancels the request
+            stream.close()
+            if self.span is not None:
+                self.span["api_time"] += time.perf_counter() - start
+        if self.response_cache is not None:
+            # a stopped answer is cached apart, only a reader stopping at the same point may take it
+            self.response_cache.put(partial_key if stopped else cache_key, "".join(pieces))
 
-    def set_meta_prompt(self, meta_prompt: str):
+    def _add_message(self, role: str, content: "str | tuple[str, ...]"):
+        message = Message(role, content)
+        num_tokens = num_tokens_from_string(message.content, self.model_name)
+        self.memory_lst.append(message)
+        self.memory_tokens.append(num_tokens)
+        self.num_context_token += num_tokens
+        if role == "assistant":
+            self.num_answers += 1
+
+    def set_meta_prompt(self, meta_prompt: "str | tuple[str, ...]"):
         """Set the meta_prompt
 
         Args:
-            meta_prompt (str): the meta prompt
+            meta_prompt (str | tuple[str, ...]): the meta prompt, or its parts
         """
-        self.memory_lst.append({"role": "system", "content": f"{meta_prompt}"})
+        self._add_message("system", meta_prompt)
 
-    def add_event(self, event: str):
+    def add_event(self, event: "str | tuple[str, ...]"):
         """Add an new event in the memory
 
         Args:
-            event (str): string that describe the event.
+            event (str | tuple[str, ...]): string that describe the event, or its parts, e.g. of PromptTemplate.render_parts
         """
-        self.memory_lst.append({"role": "user", "content": f"{event}"})
+        self._add_message("user", event)
 
-    def add_memory(self, memory: str):
+    def add_memory(self, memory: str, display: bool=True, round: int=None):
         """Monologue in the memory
 
         Args:
             memory (str): string that generated by the model in the last round.
+            display (bool): print the memory, off when it was already shown while streaming
+            round (int): debate round of the answer, for the event log
+        """
+        self._add_message("assistant", memory)
+        if self.event_log is not None:
+            # a log file keeps every message, stdout only the ones not shown while streaming
+            if display or self.event_log.path is not None:
+                self.event_log.log("message", "full", text=f"----- {self.name} -----\n{memory}\n", agent=self.name, role=self.role or self.name, round=round, content=memory)
+        elif display:
+            print(f"----- {self.name} -----\n{memory}\n")
+
+    def release(self):
+        """Drop the contents the messages keep for the queries, once the agent asks no more"""
+        for message in self.memory_lst:
+            message.release()
+
+    def fork(self) -> "Agent":
+        """Copy of the agent whose memory grows independently, the messages so far are shared
+
+        Returns:
+            Agent: the copy
         """
-        self.memory_lst.append({"role": "assistant", "content": f"{memory}"})
-        print(f"----- {self.name} -----\n{memory}\n")
+        agent = copy.copy(self)
+        agent.memory_lst = list(self.memory_lst)
+        agent.memory_tokens = list(self.memory_tokens)
+        return agent
 
-    def ask(self, temperature: float=None):
+    def ask(self, temperature: float=None, stream: bool=False, on_token=None, until=None, round: int=None):
         """Query for answer
 
         Args:
+            temperature (float): overrides the temperature of the agent
+            stream (bool): read the answer piece by piece as it is generated
+            on_token (callable): streaming mode, called with every piece of the answer as it arrives
+            until (callable): streaming mode, called with every piece, stop reading once it returns True
+            round (int): debate round of the query, for the tracer
+
+        Raises:
+            BudgetExceededException: the debate or run budget is used up, checked before querying
         """
+        if self.journal is not None:
+            ans = self.journal.replay(self.name)
+            if ans is not None:
+                if on_token is not None:
+                    on_token(ans)
+                if until is not None:
+                    until(ans)
+                return ans
+
         # query
-        num_context_token = sum([num_tokens_from_string(m["content"], self.model_name) for m in self.memory_lst])
+        messages, num_context_token = self.memory_lst, self.num_context_token
+        if self.memory_policy is not None:
+            messages, num_context_token = self.memory_policy.compact(self.memory_lst, self.memory_tokens, self.model_name)
+        # the history is sent again with every query, so its messages are joined once rather than per query
+        messages = to_dicts(messages, hold=True)
         max_token = model2max_context[self.model_name] - num_context_token
-        return self.query(self.memory_lst, max_token, api_key=self.openai_api_key, temperature=temperature if temperature else self.temperature)
-
+        if self.completion_caps is not None:
+            max_token = min(max_token, self.completion_caps.cap(self.role or self.name) or max_token)
+        budgets = [budget for budget in (self.budget, self.run_budget) if budget is not None]
+        for budget in budgets:
+            budget.check()
+        temperature = temperature if temperature else self.temperature
+        self.cached = False
+        if self.tracer is not None:
+            self.span = self.tracer.start(self, num_context_token, round=round)
+        try:
+            if not stream:
+                ans = self.query(messages, max_token, api_key=self.openai_api_key, temperature=temperature, num_tokens=num_context_token)
+            else:
+                start = time.perf_counter()
+                self.time_to_first_token = None
+                pieces = []
+                for delta in self.query_stream(messages, max_token, api_key=self.openai_api_key, temperature=temperature, num_tokens=num_context_token, until=until):
+                    if self.time_to_first_token is None:
+                        self.time_to_first_token = time.perf_counter() - start
+                    pieces.append(delta)
+                    if on_token is not None:
+                        on_token(delta)
+                ans = "".join(pieces)
+                if self.span is not None:
+                    self.span["time_to_first_token"] = self.time_to_first_token
+        except Exception as e:
+            if self.span is not None:
+                self.tracer.finish(self.span, error=e)
+                self.span = None
+            raise
+        if self.span is not None:
+            self.tracer.finish(self.span, completion=ans)
+            self.span = None
+        if (budgets or self.completion_caps is not None) and not self.cached:
+            completion_tokens = num_tokens_from_string(ans, self.model_name)
+            for budget in budgets:
+                budget.charge(self.model_name, num_context_token, completion_tokens)
+            if self.completion_caps is not None:
+                self.completion_caps.observe(self.role or self.name, completion_tokens)
+        if self.journal is not None:
+            self.journal.record(self.name, ans)
+        return ans
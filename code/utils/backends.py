@@ -0,0 +1,246 @@
+import os
+import re
+import ast
+import json
+import glob
+import time
+import random
+import hashlib
+import threading
+import openai
+from openai.api_requestor import APIRequestor
+from openai.error import RateLimitError, ServiceUnavailableError
+from .openai_utils import OutOfQuotaException, AccessTerminatedException
+from .http_client import HTTPClient
+
+support_models = ['gpt-3.5-turbo', 'gpt-3.5-turbo-0301', 'gpt-4', 'gpt-4-0314']
+
+
+class Backend:
+    """Where Agent.query sends its chat requests"""
+
+    def supports(self, model_name: str) -> bool:
+        """Whether the backend can serve model_name"""
+        return True
+
+    def chat(self, model_name: str, messages: "list[dict]", temperature: float, max_tokens: int, api_key: str, agent_name: str=None, turn: int=None) -> str:
+        """Run one chat completion
+
+        Args:
+            model_name (str): model name
+            messages (list[dict]): chat history in turbo format
+            temperature (float): sampling temperature
+            max_tokens (int): max token in api call
+            api_key (str): openai api key
+            agent_name (str): name of the asking agent, only used by offline backends
+            turn (int): number of answers the agent gave before, only used by offline backends
+
+        Returns:
+            str: the return msg
+        """
+        raise NotImplementedError
+
+    def chat_stream(self, model_name: str, messages: "list[dict]", temperature: float, max_tokens: int, api_key: str, agent_name: str=None, turn: int=None):
+        """Run one chat completion, yielding the text as it is generated
+
+        Args: same as chat
+
+        Yields:
+            str: the next piece of the return msg
+        """
+        yield self.chat(model_name, messages, temperature, max_tokens, api_key, agent_name=agent_name, turn=turn)
+
+
+class OpenAIBackend(Backend):
+    def __init__(self, api_base: str=None, client: HTTPClient=None) -> None:
+        """The openai chat completion api
+
+        Args:
+            api_base (str): base url of an openai compatible server, e.g. the local mock server
+            client (HTTPClient): connection pool every request of the process goes through, the openai
+                client's session per thread if not given
+        """
+        self.api_base = api_base
+        self.client = client
+        if client is not None:
+            openai.requestssession = client.session
+
+    def supports(self, model_name: str) -> bool:
+        return model_name in support_models
+
+    def create(self, api_key: str, **kwargs):
+        try:
+            if self.client is not None:
+                kwargs["request_timeout"] = self.client.timeout
+            return openai.ChatCompletion.create(api_key=api_key, api_base=self.api_base, **kwargs)
+
+        except RateLimitError as e:
+            raise self.key_error(api_key, e)
+
+    def key_error(self, api_key: str, e: RateLimitError) -> Exception:
+        # a rate limit error meaning the key itself is unusable
+        if "You exceeded your current quota, please check your plan and billing details" in e.user_message:
+            return OutOfQuotaException(api_key)
+        elif "Your access was terminated due to violation of our policies" in e.user_message:
+            return AccessTerminatedException(api_key)
+        return e
+
+    def open_stream(self, api_key: str, **kwargs):
+        """Start a streamed chat completion, keeping the http response
+
+        openai.ChatCompletion.create hides the response behind its generator, so an answer read only
+        in part, e.g. a verdict cut off at its closing brace, would keep its pooled connection forever.
+
+        Args:
+            api_key (str): openai api key
+            kwargs: parameters of the chat completion
+
+        Returns:
+            tuple[requests.Response, Iterator]: the response, whose close() releases the connection, and its chunks
+        """
+        requestor = APIRequestor(key=api_key, api_base=self.api_base)
+        try:
+            response = requestor.request_raw("post", "/chat/completions", params=dict(kwargs, stream=True), stream=True, request_timeout=self.client.timeout if self.client is not None else None)
+            chunks, streamed = requestor._interpret_response(response, stream=True)
+        except RateLimitError as e:
+            raise self.key_error(api_key, e)
+        return response, chunks if streamed else [chunks]
+
+    def chat(self, model_name: str, messages: "list[dict]", temperature: float, max_tokens: int, api_key: str, agent_name: str=None, turn: int=None) -> str:
+        response = self.create(api_key, model=model_name, messages=messages, temperature=temperature, max_tokens=max_tokens)
+        return response['choices'][0]['message']['content']
+
+    def chat_stream(self, model_name: str, messages: "list[dict]", temperature: float, max_tokens: int, api_key: str, agent_name: str=None, turn: int=None):
+        response, chunks = self.open_stream(api_key, model=model_name, messages=messages, temperature=temperature, max_tokens=max_tokens)
+        try:
+            for chunk in chunks:
+                choice = chunk.data['choices'][0]
+                delta = choice['delta'].get('content') if 'delta' in choice else choice['message']['content']
+                if delta:
+                    yield delta
+        finally:
+            # also reached when the caller stops reading early
+            response.close()
+
+
+class ReplayBackend(Backend):
+    # verdict keys of the recorded transcripts -> keys the current prompts ask for
+    key_map = {"Correct Translation": "debate_translation"}
+
+    def __init__(self, transcript_dir: str, latency: float=0) -> None:
+        """Serve answers from recorded MAD transcripts, e.g. data/CommonMT/Lexical_Ambiguity/MAD_Debate_Process
+
+        The debate is found by the source text quoted in the prompt, and the n-th request of an agent
+        gets the n-th recorded answer of the agent with the same name.
+
+        Args:
+            transcript_dir (str): dir of transcript json files
+            latency (float): seconds to sleep per request, to mimic the network
+        """
+        self.latency = latency
+        self.transcripts = {}
+        for path in glob.glob(os.path.join(transcript_dir, "*.json")):
+            transcript = json.load(open(path))
+            answers = {name: [m["content"] for m in memory_lst if m["role"] == "assistant"] for name, memory_lst in transcript["players"].items()}
+            # old transcripts asked the affirmative side for the base translation
+            if "Baseline" not in answers and answers.get("Affirmative side"):
+                answers["Baseline"] = answers["Affirmative side"][:1]
+                answers["Affirmative side"] = answers["Affirmative side"][1:]
+            self.transcripts[transcript["source"]] = answers
+        # longest first, so a source never matches inside a longer one
+        self.sources = sorted(self.transcripts, key=len, reverse=True)
+        self.source_of_prompt = {}
+
+    def find_source(self, messages: "list[dict]") -> str:
+        first = messages[0]["content"]
+        if first not in self.source_of_prompt:
+            text = "\n".join(m["content"] for m in messages[:2])
+            self.source_of_prompt[first] = next((source for source in self.sources if source in text), None)
+        return self.source_of_prompt[first]
+
+    def normalize(self, answer: str) -> str:
+        try:
+            verdict = ast.literal_eval(answer)
+        except (ValueError, SyntaxError):
+            return answer
+        if not isinstance(verdict, dict):
+            return answer
+        return json.dumps({self.key_map.get(k, k): v for k, v in verdict.items()}, ensure_ascii=False)
+
+    def chat(self, model_name: str, messages: "list[dict]", temperature: float, max_tokens: int, api_key: str, agent_name: str=None, turn: int=None) -> str:
+        time.sleep(self.latency)
+        source = self.find_source(messages)
+        if source is None:
+            raise KeyError(f"No recorded transcript for prompt: {messages[0]['content'][:100]}")
+        answers = self.transcripts[source].get(agent_name, [])
+        if not answers and agent_name == "Judge":
+            # the recorded moderator decided in a later round than this debate reached
+            answers = self.transcripts[source].get("Moderator", [])[-1:]
+        if turn is None:
+            turn = sum(1 for m in messages if m["role"] == "assistant")
+        if not answers:
+            raise KeyError(f"No recorded answers of {agent_name} for source: {source}")
+        # debates running more rounds than the recording repeat the last answer
+        return self.normalize(answers[min(turn, len(answers) - 1)])
+
+
+class MockBackend(Backend):
+    def __init__(self, latency: float=0, jitter: float=0, agree_round: int=2, error_rate: float=0, token_latency: float=0, seed: int=0) -> None:
+        """Deterministic fake model with a configurable latency
+
+        Debaters answer with a canned argument, moderators and judges with a json verdict.
+
+        Args:
+            latency (float): mean seconds per request
+            jitter (float): uniform +/- jitter added to latency
+            agree_round (int): moderators declare a preference, and debaters sharing a meta prompt give the same answer, from this round on
+            error_rate (float): fraction of requests failing with a retryable ServiceUnavailableError after the latency
+            token_latency (float): seconds between two streamed words, the latency is the time to the first one
+            seed (int): seed of the latency jitter and the injected errors
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.agree_round = agree_round
+        self.error_rate = error_rate
+        self.token_latency = token_latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sleep(self) -> bool:
+        with self.lock:
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+            failed = self.random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return failed
+
+    def chat(self, model_name: str, messages: "list[dict]", temperature: float, max_tokens: int, api_key: str, agent_name: str=None, turn: int=None) -> str:
+        if self.sleep():
+            raise ServiceUnavailableError("Injected mock error")
+        return self.answer(messages, turn)
+
+    def chat_stream(self, model_name: str, messages: "list[dict]", temperature: float, max_tokens: int, api_key: str, agent_name: str=None, turn: int=None):
+        if self.sleep():
+            raise ServiceUnavailableError("Injected mock error")
+        for i, word in enumerate(re.findall(r"\s*\S+", self.answer(messages, turn))):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            yield word
+
+    def answer(self, messages: "list[dict]", turn: int=None) -> str:
+        prompt = messages[-1]["content"]
+        digest = hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8]
+        if "json format" in prompt:
+            answer_key = "debate_answer" if "debate_answer" in prompt else "debate_translation"
+            round = (turn if turn is not None else sum(1 for m in messages if m["role"] == "assistant")) + 1
+            decided = "Whether there is a preference" not in prompt or round >= self.agree_round
+            return json.dumps({
+                "Whether there is a preference": "Yes" if decided else "No",
+                "Supported Side": ("Debater 1" if "Debater 1" in prompt else "Negative") if decided else "",
+                "Reason": f"Mock reason {digest}.",
+                answer_key: f"Mock answer {digest}." if decided else "",
+            })
+        if turn is not None and turn + 1 >= self.agree_round and messages[0]["role"] == "system":
+            # both sides of a debate share the meta prompt
+            digest = hashlib.md5(messages[0]["content"].encode("utf-8")).hexdigest()[:8]
+        return f"Mock argument {digest}: I think the answer is {digest}, because it is what the text says."
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+import openai
+from openai.api_requestor import APIRequestor
+from .runner import ordered_map
+
+
+def batch_request(custom_id: str, model_name: str, messages: "list[dict]", temperature: float, max_tokens: int) -> dict:
+    """One line of a batch job input file, in the format of the openai batch api
+
+    Args:
+        custom_id (str): id the answer is returned under
+        model_name (str): model name
+        messages (list[dict]): chat history in turbo format
+        temperature (float): sampling temperature
+        max_tokens (int): max token of the answer
+
+    Returns:
+        dict: the request
+    """
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {"model": model_name, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+    }
+
+
+class BatchRunner:
+    """Runs chat requests as one asynchronous batch job instead of one synchronous call each"""
+
+    def submit(self, requests: "list[dict]") -> str:
+        """Start a job
+
+        Args:
+            requests (list[dict]): requests of batch_request
+
+        Returns:
+            str: job id
+        """
+        raise NotImplementedError
+
+    def status(self, job_id: str) -> str:
+        """"in_progress", "completed" or "failed" """
+        raise NotImplementedError
+
+    def results(self, job_id: str) -> "list[dict]":
+        """Output lines of a completed job, {"custom_id": ..., "response": {"body": ...}, "error": ...}"""
+        raise NotImplementedError
+
+    def run(self, requests: "list[dict]", poll_interval: float=30) -> "dict[str, dict]":
+        """Submit a job and poll until it is done
+
+        Args:
+            requests (list[dict]): requests of batch_request
+            poll_interval (float): seconds between two status checks
+
+        Returns:
+            dict[str, dict]: custom_id -> response body of the requests that succeeded, failed ones are left out
+        """
+        if not requests:
+            return {}
+        job_id = self.submit(requests)
+        while True:
+            status = self.status(job_id)
+            if status == "completed":
+                break
+            if status == "failed":
+                print(f"batch job {job_id} failed")
+                return {}
+            time.sleep(poll_interval)
+        return {
+            line["custom_id"]: line["response"]["body"]
+            for line in self.results(job_id)
+            if not line.get("error") and line.get("response", {}).get("status_code", 200) == 200
+        }
+
+
+class LocalBatchRunner(BatchRunner):
+    def __init__(self, job_dir: str, backend, concurrency: int=8, agent_name: str=None) -> None:
+        """Stand-in for a provider batch api, for offline runs
+
+        A job is a directory with the input, output and status files of the batch api, processed by a
+        background thread through a Backend, e.g. the mock or replay backend.
+
+        Args:
+            job_dir (str): dir of the job directories
+            backend (Backend): backend answering the requests
+            concurrency (int): requests of a job in flight at the same time
+            agent_name (str): agent name the offline backends see the requests under
+        """
+        self.job_dir = job_dir
+        self.backend = backend
+        self.concurrency = concurrency
+        self.agent_name = agent_name
+        os.makedirs(job_dir, exist_ok=True)
+
+    def _path(self, job_id: str, name: str) -> str:
+        return os.path.join(self.job_dir, job_id, name)
+
+    def _set_status(self, job_id: str, status: dict):
+        path = self._path(job_id, "status.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(status, f)
+        os.replace(f"{path}.tmp", path)
+
+    def submit(self, requests: "list[dict]") -> str:
+        job_id = f"batch_{uuid.uuid4().hex[:16]}"
+        os.makedirs(os.path.join(self.job_dir, job_id))
+        with open(self._path(job_id, "input.jsonl"), "w") as f:
+            for request in requests:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        self._set_status(job_id, {"status": "validating", "total": len(requests), "completed": 0, "failed": 0})
+        threading.Thread(target=self.process, args=(job_id,), daemon=True).start()
+        return job_id
+
+    def process(self, job_id: str):
+        """Answer every request of a job and write its output file"""
+        with open(self._path(job_id, "input.jsonl"), "r") as f:
+            requests = [json.loads(line) for line in f]
+        counts = {"status": "in_progress", "total": len(requests), "completed": 0, "failed": 0}
+        self._set_status(job_id, counts)
+
+        def answer(request):
+            body = request["body"]
+            line = {"id": f"response_{uuid.uuid4().hex[:16]}", "custom_id": request["custom_id"], "response": None, "error": None}
+            try:
+                content = self.backend.chat(body["model"], body["messages"], body.get("temperature", 1), body.get("max_tokens"), None, agent_name=self.agent_name, turn=0)
+                line["response"] = {"status_code": 200, "body": {"object": "chat.completion", "model": body["model"], "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]}}
+            except Exception as e:
+                line["error"] = {"code": type(e).__name__, "message": str(e)}
+            return line
+
+        with open(self._path(job_id, "output.jsonl.tmp"), "w") as f:
+            for line in ordered_map(answer, requests, concurrency=self.concurrency):
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+                counts["failed" if line["error"] else "completed"] += 1
+        os.replace(self._path(job_id, "output.jsonl.tmp"), self._path(job_id, "output.jsonl"))
+        self._set_status(job_id, dict(counts, status="completed"))
+
+    def status(self, job_id: str) -> str:
+        with open(self._path(job_id, "status.json"), "r") as f:
+            return json.load(f)["status"]
+
+    def results(self, job_id: str) -> "list[dict]":
+        with open(self._path(job_id, "output.jsonl"), "r") as f:
+            return [json.loads(line) for line in f]
+
+
+class OpenAIBatchRunner(BatchRunner):
+    def __init__(self, api_key: str, api_base: str=None, completion_window: str="24h") -> None:
+        """The openai batch api: the input file is uploaded, the job polled and its output file downloaded
+
+        Args:
+            api_key (str): openai api key
+            api_base (str): base url of an openai compatible server
+            completion_window (str): time the provider has for the job
+        """
+        self.api_key = api_key
+        self.api_base = api_base
+        self.completion_window = completion_window
+
+    def _request(self, method: str, url: str, params: dict=None) -> dict:
+        response, _, _ = APIRequestor(key=self.api_key, api_base=self.api_base).request(method, url, params=params)
+        return response.data
+
+    def submit(self, requests: "list[dict]") -> str:
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            for request in requests:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        try:
+            with open(f.name, "rb") as file:
+                uploaded = openai.File.create(file=file, purpose="batch", api_key=self.api_key, api_base=self.api_base)
+        finally:
+            os.remove(f.name)
+        job = self._request("post", "/batches", {"input_file_id": uploaded["id"], "endpoint": "/v1/chat/completions", "completion_window": self.completion_window})
+        return job["id"]
+
+    def status(self, job_id: str) -> str:
+        status = self._request("get", f"/batches/{job_id}")["status"]
+        if status in ("failed", "expired", "cancelled"):
+            return "failed"
+        return "completed" if status == "completed" else "in_progress"
+
+    def results(self, job_id: str) -> "list[dict]":
+        job = self._request("get", f"/batches/{job_id}")
+        lines = []
+        for file_id in (job.get("output_file_id"), job.get("error_file_id")):
+            if file_id:
+                content = openai.File.download(file_id, api_key=self.api_key, api_base=self.api_base)
+                lines += [json.loads(line) for line in content.decode("utf-8").splitlines() if line.strip()]
+        return lines
+
@@ -0,0 +1,108 @@
+import threading
+from collections import deque
+from .openai_utils import model2price
+
+
+class BudgetExceededException(Exception):
+    "Raised instead of a query once a token or cost budget is used up"
+    def __init__(self, budget):
+        super().__init__(f"{budget.name} budget exceeded: {budget.tokens} tokens, ${budget.cost:.4f}")
+        self.budget = budget
+
+
+class Budget:
+    def __init__(self, name: str, max_tokens: int=None, max_cost: float=None, soft_limit: float=0.8) -> None:
+        """Hard token and cost limit of a debate or of a whole run
+
+        Args:
+            name (str): "debate" or "run", reported in BudgetExceededException
+            max_tokens (int): prompt plus completion tokens allowed, None for no limit
+            max_cost (float): dollars allowed, priced with model2price, None for no limit
+            soft_limit (float): fraction of the budget after which no new debate round is started
+        """
+        self.name = name
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.soft_limit = soft_limit
+        self.tokens = 0
+        self.cost = 0.0
+        self.lock = threading.Lock()
+
+    def used(self) -> float:
+        """Fraction of the budget used, the larger of tokens and cost"""
+        with self.lock:
+            fractions = [0.0]
+            if self.max_tokens:
+                fractions.append(self.tokens / self.max_tokens)
+            if self.max_cost:
+                fractions.append(self.cost / self.max_cost)
+            return max(fractions)
+
+    def exhausted(self) -> bool:
+        return self.used() >= 1.0
+
+    def low(self) -> bool:
+        return self.used() >= self.soft_limit
+
+    def check(self):
+        """Raise BudgetExceededException if the budget is used up"""
+        if self.exhausted():
+            raise BudgetExceededException(self)
+
+    def charge(self, model_name: str, prompt_tokens: int, completion_tokens: int):
+        """Account for one query
+
+        Args:
+            model_name (str): model name
+            prompt_tokens (int): tokens sent
+            completion_tokens (int): tokens received
+        """
+        prompt_price, completion_price = model2price.get(model_name, (0.0, 0.0))
+        with self.lock:
+            self.tokens += prompt_tokens + completion_tokens
+            self.cost += (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+    def report(self) -> dict:
+        with self.lock:
+            return {"tokens": self.tokens, "cost": round(self.cost, 6), "max_tokens": self.max_tokens, "max_cost": self.max_cost}
+
+
+class CompletionCaps:
+    def __init__(self, quantile: float=0.95, margin: float=1.5, min_cap: int=64, warmup: int=5, window: int=200) -> None:
+        """max_tokens per role learned from the observed answer lengths
+
+        Until warmup answers of a role were seen the whole remaining context is allowed, as before;
+        afterwards a query of that role may generate margin times the quantile of the recent lengths.
+
+        Args:
+            quantile (float): quantile of the observed completion tokens
+            margin (float): head room on top of the quantile
+            min_cap (int): the cap never goes below this
+            warmup (int): answers observed before a role is capped
+            window (int): number of recent answers per role kept
+        """
+        self.quantile = quantile
+        self.margin = margin
+        self.min_cap = min_cap
+        self.warmup = warmup
+        self.window = window
+        self.lengths = {}
+        self.lock = threading.Lock()
+
+    def cap(self, role: str) -> int:
+        """The max_tokens of the next query of a role, None while it is not capped yet"""
+        with self.lock:
+            lengths = sorted(self.lengths.get(role, ()))
+        if len(lengths) < self.warmup:
+            return None
+        observed = lengths[min(len(lengths) - 1, int(self.quantile * len(lengths)))]
+        return max(self.min_cap, int(observed * self.margin))
+
+    def observe(self, role: str, completion_tokens: int):
+        with self.lock:
+            self.lengths.setdefault(role, deque(maxlen=self.window)).append(completion_tokens)
+
+    def report(self) -> "dict[str, int]":
+        with self.lock:
+            roles = list(self.lengths)
+        return {role: self.cap(role) for role in roles}
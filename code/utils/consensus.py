@@ -0,0 +1,78 @@
+import re
+import difflib
+import threading
+
+
+QUOTED = re.compile(r'(?:translation|answer)\b[^\n"“]*?(?:["“][^"”\n]*["”][^\n"“]*?)?\bis:?\s*["“]([^"”\n]+)["”]', re.IGNORECASE)
+UNQUOTED = re.compile(r'\banswer\s+(?:would be|is):?\s*([^\n,;]{1,80}?)(?:[,;\n]|\.\s|\.?$)', re.IGNORECASE)
+NUMBER = re.compile(r"-?\d+(?:[.,]\d+)*(?:/\d+)?")
+
+
+def extract_candidate(text: str) -> str:
+    """The translation or answer a debater proposes
+
+    Args:
+        text (str): the debater's answer
+
+    Returns:
+        str: the candidate, None if the answer does not state one
+    """
+    match = QUOTED.search(text) or UNQUOTED.search(text)
+    if match:
+        return match.group(1).strip()
+    text = text.strip()
+    if "\n" not in text and len(text) <= 200:
+        # a bare answer such as the base translation
+        return text
+    return None
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+class ConsensusDetector:
+    def __init__(self, threshold: float=1.0, numeric: bool=False) -> None:
+        """Detects when both debaters already propose the same candidate, so the moderator need not be asked
+
+        Args:
+            threshold (float): min token-level similarity of the normalized candidates, 1.0 for equal candidates
+            numeric (bool): compare the numbers in the candidates instead, for question answering such as CIAR
+        """
+        self.threshold = threshold
+        self.numeric = numeric
+        self.lock = threading.Lock()
+        self.stats = {"checks": 0, "agreements": 0}
+
+    def similarity(self, a: str, b: str) -> float:
+        if self.numeric:
+            a, b = NUMBER.findall(a), NUMBER.findall(b)
+            return 1.0 if a and a == b else 0.0
+        a, b = normalize(a).split(), normalize(b).split()
+        if not a or not b:
+            return 0.0
+        return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+    def agree(self, answers: "list[str]") -> str:
+        """Compare the candidates of one round
+
+        Args:
+            answers (list[str]): answers of the debaters, affirmative side first
+
+        Returns:
+            str: the agreed candidate of the first debater, None if any of them disagrees
+        """
+        candidates = [extract_candidate(answer) for answer in answers]
+        agreed = None not in candidates and all(self.similarity(candidates[0], c) >= self.threshold for c in candidates[1:])
+        with self.lock:
+            self.stats["checks"] += 1
+            if agreed:
+                self.stats["agreements"] += 1
+        return candidates[0] if agreed else None
+
+    def report(self) -> dict:
+        """Checks, agreements and the rate at which the short-circuit fired"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats["rate"] = stats["agreements"] / stats["checks"] if stats["checks"] else 0.0
+        return stats
@@ -0,0 +1,81 @@
+import json
+
+
+FORMATS = ["tsv", "jsonl", "json"]
+
+
+def parse_shard(value: str) -> "tuple[int, int]":
+    """Parse a "i/n" shard spec, 0 <= i < n
+
+    Args:
+        value (str): e.g. "0/4"
+
+    Returns:
+        tuple[int, int]: shard index and number of shards
+    """
+    try:
+        index, num_shards = (int(v) for v in value.split("/"))
+    except ValueError:
+        raise ValueError(f"shard must look like i/n, got {value!r}")
+    if num_shards < 1 or not 0 <= index < num_shards:
+        raise ValueError(f"shard index must be in [0, {num_shards}), got {value!r}")
+    return index, num_shards
+
+
+def read_record(record: dict, path: str, id: int) -> dict:
+    if not isinstance(record, dict) or "source" not in record:
+        raise ValueError(f"{path}: item {id} should be an object with a \"source\", such as {{\"source\": ..., \"reference\": ...}}")
+    return {"source": record["source"], "reference": record.get("reference", "")}
+
+
+def read_corpus(path: str, shard: "tuple[int, int]"=None, offset: int=0, limit: int=None, format: str=None):
+    """Lazily read the items of a corpus file
+
+    Every line has a global id, its 0-based line number, so the same file gives the same ids on every host.
+    Lines in [offset, offset + limit) are selected first, then a shard keeps the ids with id % n == i,
+    so n hosts given shards 0/n .. n-1/n cover the selection exactly once without coordinating.
+    Blank lines keep their id but yield nothing. A json array is read whole, its items get their index as id.
+
+    Args:
+        path (str): tsv file of "source\\treference" lines, jsonl file of {"source": ..., "reference": ...} objects, or json array of them
+        shard (tuple[int, int]): (i, n) from parse_shard, None for all items
+        offset (int): first line id to read
+        limit (int): max number of line ids to read from offset, None for all
+        format (str): "tsv", "jsonl" or "json", guessed from the file extension if None
+
+    Raises:
+        ValueError: the format is unknown, a json file is not an array, or an item has no source
+
+    Yields:
+        tuple[int, dict]: global id and {"source": ..., "reference": ...}
+    """
+    if format is None:
+        format = "jsonl" if path.endswith(".jsonl") else "json" if path.endswith(".json") else "tsv"
+    if format not in FORMATS:
+        raise ValueError(f"Unknown corpus format {format!r}, expected one of {FORMATS}")
+    end = offset + limit if limit is not None else None
+    with open(path, "r", encoding="utf-8") as f:
+        if format == "json":
+            lines = json.load(f)
+            if not isinstance(lines, list):
+                raise ValueError(f"{path} should hold a json array of {{\"source\": ..., \"reference\": ...}} objects")
+        else:
+            lines = f
+        for id, line in enumerate(lines):
+            if id < offset:
+                continue
+            if end is not None and id >= end:
+                break
+            if shard is not None and id % shard[1] != shard[0]:
+                continue
+            if format == "json":
+                yield id, read_record(line, path, id)
+                continue
+            line = line.strip()
+            if not line:
+                continue
+            if format == "jsonl":
+                yield id, read_record(json.loads(line), path, id)
+            else:
+                fields = line.split("\t")
+                yield id, {"source": fields[0], "reference": fields[1] if len(fields) > 1 else ""}
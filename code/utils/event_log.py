@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import contextlib
+
+
+LEVELS = {"off": 0, "summary": 1, "full": 2}
+
+
+class EventLog:
+    def __init__(self, path: str=None, level: str="full", max_bytes: int=64 << 20, backups: int=5, max_pending: int=10000) -> None:
+        """Structured log of the debates, written by a background thread
+
+        log() only puts the event on a queue, so no agent waits for a terminal or a disk. Events of a level
+        above the configured one are dropped before anything is formatted, and when the writer falls more
+        than max_pending events behind, new events are dropped and counted instead of blocking.
+        A file gets one json line per event and is rotated to path.1 ... path.{backups} at max_bytes;
+        without a path the events are printed as readable text.
+
+        Args:
+            path (str): jsonl log file, None for stdout
+            level (str): "off", "summary" for rounds, verdicts and finished debates, "full" to add every message
+            max_bytes (int): size at which the file is rotated
+            backups (int): rotated files kept
+            max_pending (int): events queued for the writer before new ones are dropped
+        """
+        self.path = path
+        self.level = LEVELS[level]
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.file = None
+        self.writer = None
+        if self.level > 0:
+            self.writer = threading.Thread(target=self._write_loop, daemon=True)
+            self.writer.start()
+
+    def enabled(self, level: str) -> bool:
+        return LEVELS[level] <= self.level
+
+    @contextlib.contextmanager
+    def context(self, debate):
+        """Attribute the events of the current thread to a debate
+
+        Args:
+            debate: debate id
+        """
+        self.attach(debate)
+        try:
+            yield
+        finally:
+            self.attach(None)
+
+    def attach(self, debate):
+        """Attribute the events of the current thread to a debate, for threads a debate spawns"""
+        self.local.debate = debate
+
+    def current(self):
+        """The debate the current thread works on"""
+        return getattr(self.local, "debate", None)
+
+    def log(self, event: str, level: str="full", text: str=None, **fields):
+        """Queue an event
+
+        Args:
+            event (str): event name, e.g. "round" or "answer"
+            level (str): "summary" or "full"
+            text (str): readable form of the event for stdout, the fields are printed if not given
+            fields: json serializable fields, e.g. round, role and content
+        """
+        if LEVELS[level] > self.level:
+            return
+        try:
+            self.queue.put_nowait({"time": time.time(), "event": event, "debate": self.current(), **fields, "text": text})
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def close(self):
+        """Write the queued events and stop the writer"""
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _write_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            events = [event for event in batch if event is not None]
+            if self.path is None:
+                sys.stdout.write("".join(self._text(event) for event in events))
+                sys.stdout.flush()
+            elif events:
+                self._write("".join(json.dumps({k: v for k, v in event.items() if k != "text"}, ensure_ascii=False) + "\n" for event in events))
+            if batch[-1] is None:
+                return
+
+    def _text(self, event: dict) -> str:
+        if event["text"] is not None:
+            return event["text"] + "\n"
+        fields = ", ".join(f"{k}={v}" for k, v in event.items() if k not in ("time", "event", "text"))
+        return f"[{event['event']}] {fields}\n"
+
+    def _write(self, lines: str):
+        if self.file is None:
+            self.file = open(self.path, "a")
+        self.file.write(lines)
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self.file.close()
+            self.file = None
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            if self.backups > 0:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
@@ -0,0 +1,171 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+
+class ConnectionStats:
+    def __init__(self) -> None:
+        """Requests sent and connections opened by an HTTPClient"""
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def count(self, requests: int=0, connections: int=0):
+        with self.lock:
+            self.requests += requests
+            self.connections += connections
+
+    def report(self) -> dict:
+        with self.lock:
+            reused = max(self.requests - self.connections, 0)
+            return {"requests": self.requests, "connections": self.connections, "reused": reused, "reuse_rate": reused / self.requests if self.requests else 0.0}
+
+
+def counting_pool(pool_class, stats: ConnectionStats, pool_timeout: float=None):
+    # urllib3 pool that counts the connections it establishes, a dropped connection is reconnected in place,
+    # and waits at most pool_timeout seconds for a free connection
+    connection_class = pool_class.ConnectionCls
+    def connect(self):
+        stats.count(connections=1)
+        return connection_class.connect(self)
+    def _get_conn(self, timeout=None):
+        return pool_class._get_conn(self, timeout=timeout if timeout is not None else pool_timeout)
+    counting_connection = type(f"Counting{connection_class.__name__}", (connection_class,), {"connect": connect})
+    return type(f"Counting{pool_class.__name__}", (pool_class,), {"ConnectionCls": counting_connection, "_get_conn": _get_conn})
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, stats: ConnectionStats, pool_size: int, timeout: tuple, pool_timeout: float=None) -> None:
+        self.stats = stats
+        self.timeout = timeout
+        self.pool_timeout = pool_timeout
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": counting_pool(HTTPConnectionPool, self.stats, self.pool_timeout),
+            "https": counting_pool(HTTPSConnectionPool, self.stats, self.pool_timeout),
+        }
+
+    def send(self, request, timeout=None, **kwargs):
+        self.stats.count(requests=1)
+        try:
+            return super().send(request, timeout=self.timeout, **kwargs)
+        except EmptyPoolError as e:
+            # retried like any other connection error instead of escaping the openai client
+            raise requests.exceptions.ConnectionError(e, request=request)
+
+
+class HTTP2Adapter(BaseAdapter):
+    def __init__(self, stats: ConnectionStats, pool_size: int, timeout: tuple) -> None:
+        # optional dependency: pip install httpx[http2]
+        import httpx
+        super().__init__()
+        self.httpx = httpx
+        self.stats = stats
+        # network streams seen, an HTTP/2 connection carries many requests at once
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+        )
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self.stats.count(requests=1)
+        try:
+            response = self.client.send(
+                self.client.build_request(request.method, request.url, headers=dict(request.headers), content=request.body),
+                stream=True,
+            )
+        except self.httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e, request=request)
+        except self.httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+        connection = response.extensions.get("network_stream")
+        with self.lock:
+            new = connection not in self.connections
+            self.connections.add(connection)
+        if new:
+            self.stats.count(connections=1)
+        result = requests.Response()
+        result.status_code = response.status_code
+        result.headers = CaseInsensitiveDict(response.headers)
+        result.url = request.url
+        result.request = request
+        result.encoding = response.encoding
+        result.raw = HTTPXStream(response)
+        if not stream:
+            result.content
+            response.close()
+        return result
+
+    def close(self):
+        self.client.close()
+
+
+class HTTPXStream:
+    def __init__(self, response) -> None:
+        # file-like body of an httpx response, as requests reads it
+        self.response = response
+        self.chunks = response.iter_bytes()
+        self.buffer = b""
+
+    def read(self, size: int=-1, **kwargs) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        self.response.close()
+
+
+class SharedSession(requests.Session):
+    def close(self):
+        # the openai client closes its per-thread session every few minutes, which would drop the shared pool
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+class HTTPClient:
+    def __init__(self, pool_size: int=32, connect_timeout: float=10, read_timeout: float=600, http2: bool=False, pool_timeout: float=60) -> None:
+        """Keep-alive connection pool shared by every agent of the process
+
+        The openai client otherwise opens a session per thread, so every new worker thread, e.g. of the
+        concurrent turns of a panel, pays a new TCP and TLS handshake. All api requests go through one
+        session instead, whose pool keeps up to pool_size connections per host alive.
+
+        Args:
+            pool_size (int): connections kept per host, requests beyond it wait for a free one
+            connect_timeout (float): seconds to establish a connection
+            read_timeout (float): seconds to wait for the next bytes of a response
+            http2 (bool): multiplex the requests over HTTP/2 connections, needs httpx[http2]
+            pool_timeout (float): seconds a request waits for a free connection before it fails and is retried
+        """
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.stats = ConnectionStats()
+        self.session = SharedSession()
+        adapter = HTTP2Adapter(self.stats, pool_size, self.timeout) if http2 else PooledAdapter(self.stats, pool_size, self.timeout, pool_timeout)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def report(self) -> dict:
+        """Requests, connections opened and the share of requests on a reused connection"""
+        return self.stats.report()
+
+    def close(self):
+        self.session.shutdown()
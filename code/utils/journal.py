@@ -0,0 +1,88 @@
+import os
+import json
+import threading
+
+
+class Journal:
+    def __init__(self, path: str) -> None:
+        """Write-ahead journal of the completed agent turns of one debate
+
+        Every answer is appended as one json line right after the api call returns. When a
+        debate is rebuilt from the same inputs, every agent takes its answers from the journal
+        in the order it gave them, so a resumed debate never repeats a paid call. Turns are matched
+        per agent, so agents asked concurrently replay correctly whatever order they were recorded in.
+
+        Args:
+            path (str): jsonl file path, loaded if it already exists
+        """
+        self.path = path
+        self.entries = []
+        # agent name -> number of its turns replayed
+        self.positions = {}
+        self.lock = threading.Lock()
+        self.file = None
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        self.entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # the process died in the middle of a write, drop the partial turn
+                        self._rewrite()
+                        break
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def replay(self, agent_name: str) -> str:
+        """Take the next journaled answer
+
+        Args:
+            agent_name (str): name of the agent asking
+
+        Returns:
+            str: the journaled answer, None if the agent has no more journaled turns
+        """
+        with self.lock:
+            position = self.positions.get(agent_name, 0)
+            turns = [entry for entry in self.entries if entry["agent"] == agent_name]
+            if position >= len(turns):
+                return None
+            self.positions[agent_name] = position + 1
+            return turns[position]["content"]
+
+    def record(self, agent_name: str, content: str):
+        """Append a completed turn and flush it to disk
+
+        Args:
+            agent_name (str): name of the agent that answered
+            content (str): the answer
+        """
+        with self.lock:
+            entry = {"turn": len(self.entries), "agent": agent_name, "content": content}
+            if self.file is None:
+                self.file = open(self.path, "a")
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.entries.append(entry)
+            self.positions[agent_name] = self.positions.get(agent_name, 0) + 1
+
+    def _rewrite(self):
+        self.close()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        """Delete the journal once the debate result is safely saved"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
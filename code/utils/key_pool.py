@@ -0,0 +1,107 @@
+import os
+import threading
+from .openai_utils import NoAvailableKeyException
+
+
+def mask(key: str) -> str:
+    """The key as shown in logs and reports, only its last four characters"""
+    return f"...{key[-4:]}"
+
+
+class KeyPool:
+    def __init__(self, keys: "list[str]", rate_limiter=None) -> None:
+        """Pool of api keys shared by every agent of the process
+
+        Each call takes the key with the most remaining rate capacity (fewest calls in flight when
+        no rate limiter is used). Keys that ran out of quota or were terminated are retired, and the
+        debate goes on with the others.
+
+        Args:
+            keys (list[str]): openai api keys, duplicates are ignored
+            rate_limiter (RateLimiter): limiter whose per key buckets steer the balancing
+        """
+        self.keys = list(dict.fromkeys(k for k in keys if k))
+        if not self.keys:
+            raise ValueError("KeyPool needs at least one api key")
+        self.rate_limiter = rate_limiter
+        self.lock = threading.Lock()
+        # masked key -> name of the exception that retired it, never the full key
+        self.retired = {}
+        self.stats = {key: {"requests": 0, "tokens": 0, "in_flight": 0, "failures": 0} for key in self.keys}
+
+    @classmethod
+    def from_file(cls, path: str, rate_limiter=None) -> "KeyPool":
+        """One key per line, blank lines and lines starting with # are skipped"""
+        with open(path, "r") as f:
+            keys = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        return cls(keys, rate_limiter=rate_limiter)
+
+    @classmethod
+    def from_env(cls, name: str="OPENAI_API_KEYS", rate_limiter=None) -> "KeyPool":
+        """Comma or whitespace separated keys in an environment variable"""
+        return cls(os.environ.get(name, "").replace(",", " ").split(), rate_limiter=rate_limiter)
+
+    def __len__(self) -> int:
+        return len(self.keys) - len(self.retired)
+
+    def acquire(self, model_name: str, num_tokens: int=0) -> str:
+        """Take a key for one call, give it back with release()
+
+        Args:
+            model_name (str): model name
+            num_tokens (int): prompt tokens of the call
+
+        Raises:
+            NoAvailableKeyException: every key has been retired
+
+        Returns:
+            str: the api key to use
+        """
+        with self.lock:
+            active = [key for key in self.keys if mask(key) not in self.retired]
+            if not active:
+                raise NoAvailableKeyException(dict(self.retired))
+            if self.rate_limiter is not None:
+                remaining = {key: self.rate_limiter.remaining(model_name, key) for key in active}
+            else:
+                remaining = {key: 0.0 for key in active}
+            key = max(active, key=lambda k: (remaining[k], -self.stats[k]["in_flight"], -self.stats[k]["requests"]))
+            stats = self.stats[key]
+            stats["requests"] += 1
+            stats["tokens"] += num_tokens
+            stats["in_flight"] += 1
+            return key
+
+    def release(self, key: str, failed: bool=False):
+        """Give back a key taken with acquire()
+
+        Args:
+            key (str): the api key
+            failed (bool): the call raised
+        """
+        with self.lock:
+            self.stats[key]["in_flight"] -= 1
+            if failed:
+                self.stats[key]["failures"] += 1
+
+    def retire(self, key: str, reason: Exception):
+        """Stop handing out a key
+
+        Args:
+            key (str): the api key
+            reason (Exception): why, e.g. OutOfQuotaException
+        """
+        with self.lock:
+            if mask(key) not in self.retired:
+                # the message of the exception holds the full key
+                self.retired[mask(key)] = type(reason).__name__
+                print(f"retired api key {mask(key)}: {type(reason).__name__}, {len(self)} left")
+
+    def report(self) -> "dict[str, dict]":
+        """Usage counters of every key
+
+        Returns:
+            dict[str, dict]: "...key-suffix" -> requests, tokens, in_flight, failures, retired
+        """
+        with self.lock:
+            return {mask(key): dict(self.stats[key], retired=self.retired.get(mask(key))) for key in self.keys}
@@ -0,0 +1,101 @@
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from .openai_utils import get_encoding, num_tokens_from_string
+
+
+def lead_summary(text: str, model_name: str, max_tokens: int) -> str:
+    """Extractive summary: the leading sentences of text that fit in max_tokens
+
+    Args:
+        text (str): text to summarize
+        model_name (str): model whose tokenizer measures the budget
+        max_tokens (int): token budget of the summary
+
+    Returns:
+        str: the summary
+    """
+    encoding = get_encoding(model_name)
+    if len(encoding.encode(text)) <= max_tokens:
+        return text
+    summary = ""
+    for sentence in re.split(r"(?<=[.!?。！？])\s+", text.strip()):
+        candidate = f"{summary} {sentence}".strip()
+        if len(encoding.encode(candidate)) > max_tokens:
+            break
+        summary = candidate
+    if not summary:
+        summary = encoding.decode(encoding.encode(text)[:max_tokens])
+    return f"{summary} ..."
+
+
+class MemoryPolicy:
+    def __init__(self, keep_last: int=4, summary_tokens: int=80, max_summaries: int=6, summarizer=lead_summary, max_cached: int=10000) -> None:
+        """Which part of an agent's memory is sent with each query
+
+        The system meta prompt and the last keep_last messages are sent verbatim; older messages are folded
+        into one message of short summaries, so the prompt stops growing with the number of rounds.
+        Summaries are cached by content and shared by every agent using the policy, an answer quoted to
+        both sides is summarized once. The cache keeps the max_cached most recently used summaries.
+
+        Args:
+            keep_last (int): number of most recent messages sent verbatim, at least 1 so the prompt of the query is
+            summary_tokens (int): token budget of the summary of one folded message
+            max_summaries (int): number of folded messages kept as summaries, older ones are dropped
+            summarizer (callable): summarizer(text, model_name, max_tokens) -> str
+            max_cached (int): summaries kept in the cache, least recently used are dropped first
+
+        Raises:
+            ValueError: keep_last is less than 1
+        """
+        if keep_last < 1:
+            raise ValueError(f"keep_last must be at least 1, the last message is the prompt of the query, got {keep_last}")
+        self.keep_last = keep_last
+        self.summary_tokens = summary_tokens
+        self.max_summaries = max_summaries
+        self.summarizer = summarizer
+        self.cache = OrderedDict()
+        self.max_cached = max_cached
+        self.lock = threading.Lock()
+
+    def summarize(self, text: str, model_name: str) -> str:
+        key = (hashlib.sha1(text.encode("utf-8")).hexdigest(), model_name)
+        with self.lock:
+            summary = self.cache.get(key)
+            if summary is not None:
+                self.cache.move_to_end(key)
+                return summary
+        summary = self.summarizer(text, model_name, self.summary_tokens)
+        with self.lock:
+            self.cache[key] = summary
+            if len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return summary
+
+    def compact(self, memory_lst: "list[dict]", memory_tokens: "list[int]", model_name: str) -> "tuple[list[dict], int]":
+        """Build the messages sent for a memory
+
+        Args:
+            memory_lst (list[dict]): full chat history in turbo format
+            memory_tokens (list[int]): token count of every message of memory_lst
+            model_name (str): model name
+
+        Returns:
+            tuple[list[dict], int]: the messages to send and their token count
+        """
+        num_system = 0
+        while num_system < len(memory_lst) and memory_lst[num_system]["role"] == "system":
+            num_system += 1
+        start = max(num_system, len(memory_lst) - self.keep_last)
+        folded = memory_lst[max(num_system, start - self.max_summaries):start]
+        if not folded:
+            return memory_lst, sum(memory_tokens)
+
+        lines = [
+            f"- {'You' if m['role'] == 'assistant' else 'Them'}: {self.summarize(m['content'], model_name)}" for m in folded
+        ]
+        summary = {"role": "user", "content": "Summary of the earlier debate:\n" + "\n".join(lines)}
+        messages = memory_lst[:num_system] + [summary] + memory_lst[start:]
+        num_tokens = sum(memory_tokens[:num_system]) + num_tokens_from_string(summary["content"], model_name) + sum(memory_tokens[start:])
+        return messages, num_tokens
@@ -0,0 +1,73 @@
+import sys
+
+
+class Message:
+    __slots__ = ("role", "parts", "joined")
+
+    def __init__(self, role: str, content: "str | tuple[str, ...]") -> None:
+        """A chat message of an agent's memory
+
+        The content is kept as the parts it was built from, e.g. the literals of a prompt template and
+        the answer it quotes, so the answer is held once however many agents hear it. The parts are
+        joined when the content is read, and the message reads like the {"role": ..., "content": ...}
+        dict of the turbo format. A message sent with every query of a debate is joined once by hold()
+        and keeps that copy until release(), when the debate is over.
+
+        Args:
+            role (str): "system", "user" or "assistant"
+            content (str | tuple[str, ...]): the text, or its parts
+        """
+        self.role = sys.intern(role)
+        self.parts = content if isinstance(content, tuple) else (content,)
+        self.joined = None
+
+    @property
+    def content(self) -> str:
+        if len(self.parts) == 1:
+            return self.parts[0]
+        return self.joined if self.joined is not None else "".join(self.parts)
+
+    def hold(self) -> str:
+        """The content, joined on the first call and kept until release()"""
+        if self.joined is None and len(self.parts) > 1:
+            self.joined = "".join(self.parts)
+        return self.content
+
+    def release(self):
+        """Drop the content kept by hold(), the parts stay"""
+        self.joined = None
+
+    def __getitem__(self, key: str) -> str:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def keys(self) -> "tuple[str, str]":
+        return ("role", "content")
+
+    def get(self, key: str, default=None):
+        return self[key] if key in ("role", "content") else default
+
+    def to_dict(self) -> dict:
+        """The message in turbo format"""
+        return {"role": self.role, "content": self.content}
+
+    def __repr__(self) -> str:
+        return f"Message({self.role!r}, {self.content!r})"
+
+
+def to_dicts(memory_lst: "list", hold: bool=False) -> "list[dict]":
+    """Messages in turbo format, e.g. for an api payload or a save file
+
+    Args:
+        memory_lst (list): Message or dict messages
+        hold (bool): keep the joined contents on the messages, for a history sent again with the next query
+
+    Returns:
+        list[dict]: the messages as dicts
+    """
+    if hold:
+        return [{"role": message.role, "content": message.hold()} if isinstance(message, Message) else message for message in memory_lst]
+    return [message.to_dict() if isinstance(message, Message) else message for message in memory_lst]
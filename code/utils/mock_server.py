@@ -0,0 +1,165 @@
+"""
+Local openai compatible chat completion server for offline load tests.
+
+    cd code && python3 -m utils.mock_server --port 8000 --latency 0.8 --jitter 0.3
+
+then point the debate at it with `--backend openai --api-base http://127.0.0.1:8000/v1`.
+GET /stats returns the connections accepted and requests served so far.
+"""
+
+
+import json
+import time
+import itertools
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .backends import Backend, MockBackend
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # set by serve_mock
+    backend = None
+    stats = None
+    chunked = True
+
+    def setup(self):
+        # one handler per connection
+        super().setup()
+        self.count("connections")
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # the client dropped a kept-alive connection
+            pass
+
+    def count(self, key: str):
+        with self.stats["lock"]:
+            self.stats[key] += 1
+
+    def do_GET(self):
+        # connections accepted and requests served, to check the connection reuse of a client
+        if self.path.rstrip("/") != "/stats":
+            self.send_error(404)
+            return
+        with self.stats["lock"]:
+            response = json.dumps({"connections": self.stats["connections"], "requests": self.stats["requests"]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        self.count("requests")
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        request = dict(
+            model_name=body.get("model"),
+            messages=body["messages"],
+            temperature=body.get("temperature", 1),
+            max_tokens=body.get("max_tokens"),
+            api_key=self.headers.get("Authorization", "").replace("Bearer ", ""),
+        )
+        if body.get("stream"):
+            self.stream(body, self.backend.chat_stream(**request))
+            return
+
+        content = self.backend.chat(**request)
+        response = json.dumps({
+            "id": f"chatcmpl-mock-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def stream(self, body: dict, deltas):
+        # server-sent events; in chunked encoding a stream read to its end leaves the connection reusable,
+        # otherwise the end of the stream is marked by closing the connection
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        if self.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        id = f"chatcmpl-mock-{time.time_ns()}"
+        try:
+            for delta in itertools.chain([{"role": "assistant"}], ({"content": d} for d in deltas), [{}]):
+                chunk = {
+                    "id": id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None if delta else "stop"}],
+                }
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.write_chunk(b"data: [DONE]\n\n")
+            if self.chunked:
+                self.write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped reading, e.g. once the moderator verdict was decided
+            self.close_connection = True
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n" if self.chunked else data)
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_mock(backend: Backend=None, host: str="127.0.0.1", port: int=0, background: bool=True, chunked: bool=True) -> ThreadingHTTPServer:
+    """Start a chat completion server answering with backend
+
+    Args:
+        backend (Backend): backend producing the answers, a MockBackend by default
+        host (str): host to bind
+        port (int): port to bind, 0 picks a free one (see server.server_address)
+        background (bool): serve from a daemon thread and return, otherwise block
+        chunked (bool): stream in chunked encoding on a kept-alive connection, otherwise until the connection closes
+
+    Returns:
+        ThreadingHTTPServer: the running server, call shutdown() to stop it
+    """
+    stats = {"lock": threading.Lock(), "connections": 0, "requests": 0}
+    handler = type("BoundMockRequestHandler", (MockRequestHandler,), {"backend": backend or MockBackend(), "stats": stats, "chunked": chunked})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind")
+    parser.add_argument("--port", type=int, default=8000, help="Port to bind")
+    parser.add_argument("--latency", type=float, default=0, help="Mean seconds per request")
+    parser.add_argument("--jitter", type=float, default=0, help="Uniform +/- jitter of the latency")
+    parser.add_argument("--token-latency", type=float, default=0, help="Seconds between two streamed words")
+    parser.add_argument("--close-streams", action="store_true", help="End streams by closing the connection instead of chunked encoding")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"mock chat completion server on http://{args.host}:{args.port}/v1")
+    serve_mock(MockBackend(latency=args.latency, jitter=args.jitter, token_latency=args.token_latency), host=args.host, port=args.port, background=False, chunked=not args.close_streams)
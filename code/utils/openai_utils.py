@@ -1,4 +1,5 @@
 import tiktoken
+from functools import lru_cache
 
 
 model2max_context = {
@@ -10,6 +11,16 @@ model2max_context = {
     "text-davinci-002": 4096,
 }
 
+# dollars per 1k (prompt, completion) tokens
+model2price = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-0314": (0.03, 0.06),
+    "gpt-3.5-turbo-0301": (0.0015, 0.002),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "text-davinci-003": (0.02, 0.02),
+    "text-davinci-002": (0.02, 0.02),
+}
+
 class OutOfQuotaException(Exception):
     "Raised when the key exceeded the current quota"
     def __init__(self, key, cause=None):
@@ -36,9 +47,26 @@ class AccessTerminatedException(Exception):
         else:
             return super().__str__()
 
+class NoAvailableKeyException(Exception):
+    "Raised when every key of the pool has been retired"
+    def __init__(self, retired=None):
+        super().__init__("No api key left in the pool")
+        self.retired = retired or {}
+
+    def __str__(self):
+        if self.retired:
+            return f"{super().__str__()}. Retired: {self.retired}"
+        else:
+            return super().__str__()
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str):
+    """Returns the tiktoken encoder of a model, built once per process."""
+    return tiktoken.encoding_for_model(model_name)
+
 def num_tokens_from_string(string: str, model_name: str) -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.encoding_for_model(model_name)
+    encoding = get_encoding(model_name)
     num_tokens = len(encoding.encode(string))
     return num_tokens
 
@@ -0,0 +1,123 @@
+import time
+import threading
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float) -> None:
+        """A token bucket that hands out reservations
+
+        Callers may drive the bucket below zero; the deficit is the time they have to wait,
+        so concurrent callers are admitted in arrival order, exactly when capacity frees up.
+
+        Args:
+            capacity (float): max number of tokens in the bucket
+            refill_per_second (float): tokens added per second
+        """
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take amount tokens from the bucket
+
+        Args:
+            amount (float): tokens needed, clamped to the capacity so huge requests can still pass
+            now (float): time.monotonic() of the request
+
+        Returns:
+            float: seconds to wait before the reservation is covered
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_per_second)
+        self.last_refill = now
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.refill_per_second
+
+    def level(self, now: float) -> float:
+        """Fraction of the capacity available at now, negative while callers are queued"""
+        tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_per_second)
+        return tokens / self.capacity
+
+
+class RateLimiter:
+    def __init__(self, rpm: float=None, tpm: float=None) -> None:
+        """Process-wide requests-per-minute and tokens-per-minute limiter
+
+        One pair of buckets is kept for every (model, api key), shared by all agents of the process.
+
+        Args:
+            rpm (float): requests per minute allowed for each (model, key), None for no limit
+            tpm (float): tokens per minute allowed for each (model, key), None for no limit
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.stats = {}
+
+    def _get_buckets(self, model_name: str, api_key: str):
+        key = (model_name, api_key)
+        if key not in self.buckets:
+            self.buckets[key] = (
+                TokenBucket(self.rpm, self.rpm / 60) if self.rpm else None,
+                TokenBucket(self.tpm, self.tpm / 60) if self.tpm else None,
+            )
+            self.stats[key] = {"requests": 0, "tokens": 0, "waited_requests": 0, "wait_time": 0.0, "max_wait_time": 0.0}
+        return self.buckets[key], self.stats[key]
+
+    def acquire(self, model_name: str, api_key: str, num_tokens: int=0) -> float:
+        """Block until a request of num_tokens tokens may be sent
+
+        Args:
+            model_name (str): model name
+            api_key (str): openai api key
+            num_tokens (int): tokens of the request
+
+        Returns:
+            float: seconds spent waiting in the queue
+        """
+        with self.lock:
+            (request_bucket, token_bucket), stats = self._get_buckets(model_name, api_key)
+            now = time.monotonic()
+            wait = 0.0
+            if request_bucket is not None:
+                wait = max(wait, request_bucket.reserve(1, now))
+            if token_bucket is not None:
+                wait = max(wait, token_bucket.reserve(num_tokens, now))
+            stats["requests"] += 1
+            stats["tokens"] += num_tokens
+            if wait > 0:
+                stats["waited_requests"] += 1
+                stats["wait_time"] += wait
+                stats["max_wait_time"] = max(stats["max_wait_time"], wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def remaining(self, model_name: str, api_key: str) -> float:
+        """Fraction of the capacity of a (model, key) available now
+
+        Args:
+            model_name (str): model name
+            api_key (str): openai api key
+
+        Returns:
+            float: min over the request and token buckets, 1.0 for an unused or unlimited key, negative while requests wait
+        """
+        with self.lock:
+            buckets = self.buckets.get((model_name, api_key))
+            if buckets is None:
+                return 1.0
+            now = time.monotonic()
+            return min([bucket.level(now) for bucket in buckets if bucket is not None], default=1.0)
+
+    def report(self) -> "dict[str, dict]":
+        """Queue statistics for every (model, key)
+
+        Returns:
+            dict[str, dict]: "model/key-suffix" -> requests, tokens, waited_requests, wait_time, max_wait_time
+        """
+        with self.lock:
+            return {f"{model_name}/...{api_key[-4:] if api_key else ''}": dict(stats) for (model_name, api_key), stats in self.stats.items()}
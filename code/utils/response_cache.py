@@ -0,0 +1,140 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class ResponseCache:
+    def __init__(self, path: str, max_entries: int=None, max_age: float=None, evict_every: int=100) -> None:
+        """Persistent response cache keyed by a hash of the request
+
+        Backed by SQLite in WAL mode, so several threads and worker processes can share one file.
+
+        Args:
+            path (str): sqlite file path
+            max_entries (int): keep at most this many responses, least recently used are evicted first
+            max_age (float): drop responses older than this many seconds
+            evict_every (int): run eviction after this many writes
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        conn.commit()
+        self.evict()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections must not be shared between threads
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(model_name: str, messages: "list[dict]", temperature: float, max_tokens: int, partial: bool=False) -> str:
+        """Content address of a request
+
+        Args:
+            model_name (str): model name
+            messages (list[dict]): chat history in turbo format
+            temperature (float): sampling temperature
+            max_tokens (int): max token in api call
+            partial (bool): key of the answer up to where the reader of a stream stopped, never that of the full answer
+
+        Returns:
+            str: sha256 hex digest
+        """
+        request = {
+            "model": model_name,
+            "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        if partial:
+            request["partial"] = True
+        return hashlib.sha256(json.dumps(request, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str, count_miss: bool=True) -> str:
+        """Look up a response
+
+        Args:
+            key (str): key from make_key
+            count_miss (bool): count a miss, off for a lookup that another one follows
+
+        Returns:
+            str: the cached response, None on a miss
+        """
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None and self.max_age is not None and row[1] < now - self.max_age:
+            row = None
+        with self.lock:
+            if row is None:
+                self.misses += count_miss
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return row[0]
+
+    def put(self, key: str, response: str):
+        """Store a response
+
+        Args:
+            key (str): key from make_key
+            response (str): the return msg of the api
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)", (key, response, now, now))
+        conn.commit()
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop expired responses, then the least recently used ones above max_entries"""
+        conn = self._connect()
+        if self.max_age is not None:
+            conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+        if self.max_entries is not None:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed ASC LIMIT max(0, (SELECT COUNT(*) FROM responses) - ?))",
+                (self.max_entries,)
+            )
+        conn.commit()
+
+    def stats(self) -> dict:
+        """Hit/miss counters of this process
+
+        Returns:
+            dict: hits, misses, writes, hit_rate and the number of stored entries
+        """
+        entries = self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+            }
@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import zlib
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResultStore:
+    def __init__(self, path: str, compress: bool=True, segment_bytes: int=64 << 20, max_pending: int=256, max_strings: int=4096) -> None:
+        """Append-only store of finished debates
+
+        Records are appended to segment files by a background writer, in batches with one fsync each,
+        and located through index.jsonl, a small line of (kind, id, segment, offset, length) per record,
+        so a record is read back with one seek and without parsing the rest of the corpus.
+        The prompts of a record (top-level "*_prompt" fields and system messages) are interned: every
+        distinct text is stored once per store and records keep {"$ref": n} in its place.
+        A record only counts as stored once its index line is written, so a crash never leaves a half record.
+
+        Args:
+            path (str): store directory, opened for appending if it exists
+            compress (bool): zlib-compress every record, only used when the store is created
+            segment_bytes (int): a new segment file is started once the current one is larger
+            max_pending (int): put() blocks while that many records wait for the writer
+            max_strings (int): interned texts kept in memory once read, least recently used are dropped first
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {"version": 1, "compress": compress}
+            with open(meta_path, "w") as f:
+                json.dump(self.meta, f)
+        self.segment_bytes = segment_bytes
+
+        # kind ("r" record, "s" string) -> id -> (segment, offset, length), the latest entry of an id wins
+        self.index = {"r": {}, "s": {}}
+        self.hashes = {}
+        # ref -> interned text read back, an LRU of this store only
+        self.strings = OrderedDict()
+        self.max_strings = max_strings
+        index_path = os.path.join(path, "index.jsonl")
+        if os.path.exists(index_path):
+            committed = 0
+            with open(index_path, "rb") as f:
+                for line in f:
+                    try:
+                        kind, id, segment, offset, length, *digest = json.loads(line)
+                    except ValueError:
+                        break
+                    committed += len(line)
+                    self.index[kind][id] = (segment, offset, length)
+                    if digest:
+                        self.hashes[digest[0]] = id
+            if committed < os.path.getsize(index_path):
+                # the process died in the middle of a write, those records were never committed
+                with open(index_path, "r+b") as f:
+                    f.truncate(committed)
+        self.segment = max([entry[0] for entries in self.index.values() for entry in entries.values()], default=0)
+
+        self.lock = threading.Lock()
+        self.fds = {}
+        self.pending = {}
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.writer = None
+
+    def __contains__(self, id: int) -> bool:
+        return id in self.index["r"] or id in self.pending
+
+    def __len__(self) -> int:
+        return len(self.ids())
+
+    def ids(self) -> "list[int]":
+        """Ids of the stored and pending records, sorted"""
+        with self.lock:
+            return sorted(set(self.index["r"]) | set(self.pending))
+
+    def put(self, id: int, record: dict, on_written=None):
+        """Queue a record for the background writer
+
+        Args:
+            id (int): record id, a later record of the same id replaces the earlier one
+            record (dict): json serializable record, it must not be modified afterwards
+            on_written (callable): called without arguments once the record is on disk
+        """
+        if self.error is not None:
+            raise self.error
+        with self.lock:
+            self.pending[id] = record
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_loop, daemon=True)
+                self.writer.start()
+        self.queue.put((id, record, on_written))
+
+    def get(self, id: int) -> dict:
+        """Read one record
+
+        Args:
+            id (int): record id
+
+        Raises:
+            KeyError: no such record
+
+        Returns:
+            dict: the record with the interned prompts restored
+        """
+        with self.lock:
+            if id in self.pending:
+                return self.pending[id]
+            location = self.index["r"][id]
+        return self._expand(json.loads(self._read(location)))
+
+    def __iter__(self):
+        for id in self.ids():
+            yield id, self.get(id)
+
+    def flush(self):
+        """Block until every queued record is on disk"""
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """Flush and close the store"""
+        if self.writer is not None:
+            self.flush()
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        with self.lock:
+            for fd in self.fds.values():
+                os.close(fd)
+            self.fds = {}
+            self.strings.clear()
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"segment-{segment:05d}.dat")
+
+    def _read(self, location: tuple) -> str:
+        segment, offset, length = location
+        with self.lock:
+            fd = self.fds.get(segment)
+            if fd is None:
+                fd = self.fds[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+        data = os.pread(fd, length, offset)
+        if self.meta["compress"]:
+            data = zlib.decompress(data)
+        return data.decode("utf-8")
+
+    def _string(self, ref: int) -> str:
+        with self.lock:
+            text = self.strings.get(ref)
+            if text is not None:
+                self.strings.move_to_end(ref)
+                return text
+        text = self._read(self.index["s"][ref])
+        with self.lock:
+            self.strings[ref] = text
+            if len(self.strings) > self.max_strings:
+                self.strings.popitem(last=False)
+        return text
+
+    def _expand(self, record: dict) -> dict:
+        for key, value in record.items():
+            if isinstance(value, dict) and "$ref" in value:
+                record[key] = self._string(value["$ref"])
+        for memory_lst in record.get("players", {}).values():
+            for message in memory_lst:
+                if isinstance(message["content"], dict):
+                    message["content"] = self._string(message["content"]["$ref"])
+        return record
+
+    def _intern(self, text: str, chunks: list, entries: list) -> dict:
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        ref = self.hashes.get(digest)
+        if ref is None:
+            ref = self.hashes[digest] = len(self.index["s"]) + len(entries)
+            chunks.append(("s", ref, text, digest))
+            entries.append(ref)
+        return {"$ref": ref}
+
+    def _compact(self, record: dict, chunks: list, entries: list) -> dict:
+        record = dict(record)
+        for key, value in record.items():
+            if key.endswith("_prompt") and isinstance(value, str):
+                record[key] = self._intern(value, chunks, entries)
+        if "players" in record:
+            record["players"] = {
+                name: [
+                    dict(message, content=self._intern(message["content"], chunks, entries)) if message["role"] == "system" else message
+                    for message in memory_lst
+                ]
+                for name, memory_lst in record["players"].items()
+            }
+        return record
+
+    def _write_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            jobs = [job for job in batch if job is not None]
+            try:
+                if jobs:
+                    self._write(jobs)
+            except Exception as e:
+                self.error = e
+            for _ in batch:
+                self.queue.task_done()
+            if batch[-1] is None:
+                return
+
+    def _write(self, jobs: list):
+        # strings first, so an indexed record never refers to a missing string
+        chunks, entries = [], []
+        for id, record, _ in jobs:
+            chunks.append(("r", id, json.dumps(self._compact(record, chunks, entries), ensure_ascii=False), None))
+
+        segment_path = self._segment_path(self.segment)
+        offset = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+        if offset >= self.segment_bytes:
+            self.segment += 1
+            segment_path, offset = self._segment_path(self.segment), 0
+        lines = []
+        with open(segment_path, "ab") as f:
+            for kind, id, text, digest in chunks:
+                data = text.encode("utf-8")
+                if self.meta["compress"]:
+                    data = zlib.compress(data)
+                f.write(data)
+                entry = [kind, id, self.segment, offset, len(data)] + ([digest] if digest else [])
+                lines.append((entry, json.dumps(entry) + "\n"))
+                offset += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(os.path.join(self.path, "index.jsonl"), "a") as f:
+            f.write("".join(line for _, line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self.lock:
+            for (kind, id, segment, offset, length, *_), _ in lines:
+                self.index[kind][id] = (segment, offset, length)
+            for id, record, _ in jobs:
+                if self.pending.get(id) is record:
+                    del self.pending[id]
+        for _, _, on_written in jobs:
+            if on_written is not None:
+                on_written()
+
+
+if __name__ == "__main__":
+    # python -m utils.result_store DIR [ID ...]: print records as indented json
+    store = ResultStore(sys.argv[1])
+    ids = [int(id) for id in sys.argv[2:]] or store.ids()
+    for id in ids:
+        print(json.dumps(store.get(id), ensure_ascii=False, indent=4))
@@ -0,0 +1,37 @@
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def ordered_map(fn, items, concurrency: int=1, max_pending: int=None):
+    """Run fn over items with a bounded number of items in flight, yielding results in input order
+
+    Args:
+        fn (callable): worker called once per item
+        items (iterable): work items, consumed lazily
+        concurrency (int): number of items processed at the same time
+        max_pending (int): max number of submitted items whose results have not been yielded yet,
+            bounds memory when an early item is slow (default: 2 * concurrency)
+
+    Yields:
+        the return value of fn for each item, in the order of items
+    """
+    concurrency = max(1, concurrency)
+    if concurrency == 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    max_pending = max(concurrency, max_pending or 2 * concurrency)
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque(executor.submit(fn, item) for item in itertools.islice(items, max_pending))
+        try:
+            while pending:
+                result = pending.popleft().result()
+                for item in itertools.islice(items, 1):
+                    pending.append(executor.submit(fn, item))
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,163 @@
+import re
+import math
+from collections import Counter
+from functools import lru_cache
+
+
+# 1,000.5 | 3/2 | 1 / e | 75% | 1:1
+NUMBER = re.compile(r"(?<![\w.])(-?\d+(?:,\d{3})*(?:\.\d+)?|-?\.\d+)(?:\s*(/|:)\s*(\d+(?:\.\d+)?|e\b))?\s*(%|percent\b)?", re.IGNORECASE)
+TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def parse_numbers(text: str) -> "list[list[tuple[float, float]]]":
+    """The numbers in an answer, with the tolerance their written precision allows
+
+    "0.67" matches 2/3 and "75%" matches both 0.75 and 75, fractions and ratios are divided out.
+
+    Args:
+        text (str): answer or gold answer
+
+    Returns:
+        list[list[tuple[float, float]]]: per number the (value, tolerance) readings
+    """
+    numbers = []
+    for whole, op, denominator, percent in NUMBER.findall(text):
+        whole = whole.replace(",", "")
+        decimals = len(whole.split(".")[1]) if "." in whole else 0
+        if op:
+            denominator = math.e if denominator.lower() == "e" else float(denominator)
+            if denominator == 0:
+                continue
+            value = float(whole) / denominator
+            tolerance = max(abs(value) * 1e-3, 1e-9)
+        else:
+            value = float(whole)
+            tolerance = 0.5 * 10 ** -decimals if decimals else 1e-9
+        numbers.append([(value, tolerance)] + ([(value / 100, tolerance / 100)] if percent else []))
+    return numbers
+
+
+def normalize_answer(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s.%/:]", " ", text.lower()).split())
+
+
+def matches(prediction: str, golds: "list[str]", strict: bool=False) -> bool:
+    """Whether an answer states one of the gold answers
+
+    Numeric golds are compared by value within the gold's precision and all numbers of a gold such as
+    "6 or 12" must be stated, other golds are compared as a normalized substring.
+
+    Args:
+        prediction (str): the answer
+        golds (list[str]): acceptable answers
+        strict (bool): compare numbers up to rounding errors only, so "0.0909" does not match "0.1"
+
+    Returns:
+        bool: a gold answer was found
+    """
+    predicted = [value for readings in parse_numbers(prediction) for value, _ in readings]
+    text = normalize_answer(prediction)
+    for gold in golds:
+        numbers = parse_numbers(gold)
+        if numbers:
+            if all(
+                any(abs(p - g) <= (max(abs(g) * 1e-3, 1e-9) if strict else tolerance) for g, tolerance in readings for p in predicted)
+                for readings in numbers
+            ):
+                return True
+        elif normalize_answer(gold) and normalize_answer(gold) in text:
+            return True
+    return False
+
+
+def judge_answer(prediction: str, answers: "list[str]", incorrect: "list[str]"=()) -> bool:
+    """CIAR correctness: the answer states a gold answer and none of the known incorrect answers
+
+    Args:
+        prediction (str): the answer
+        answers (list[str]): the "answer" list of CIAR.json
+        incorrect (list[str]): the "incorrect answer" list of CIAR.json
+
+    Returns:
+        bool: the answer is correct
+    """
+    if not prediction or not matches(prediction, answers):
+        return False
+    # an incorrect answer contained in a gold one, "6" in "6 or 12", is not held against the prediction
+    incorrect = [answer for answer in incorrect if not any(matches(gold, [answer], strict=True) for gold in answers)]
+    return not matches(prediction, incorrect, strict=True)
+
+
+def tokenize(text: str) -> "list[str]":
+    return TOKEN.findall(text)
+
+
+def bleu_stats(hypothesis: str, reference: str, max_order: int=4) -> "list[int]":
+    """Sufficient statistics of BLEU for one sentence, summed over a corpus before corpus_bleu
+
+    Returns:
+        list[int]: hypothesis length, reference length, then matches and totals per n-gram order
+    """
+    hyp, ref = tokenize(hypothesis), tokenize(reference)
+    stats = [len(hyp), len(ref)]
+    for n in range(1, max_order + 1):
+        hyp_ngrams = Counter(tuple(hyp[i:i + n]) for i in range(len(hyp) - n + 1))
+        ref_ngrams = Counter(tuple(ref[i:i + n]) for i in range(len(ref) - n + 1))
+        stats.append(sum((hyp_ngrams & ref_ngrams).values()))
+        stats.append(max(len(hyp) - n + 1, 0))
+    return stats
+
+
+def corpus_bleu(stats: "list[int]") -> float:
+    """Corpus BLEU (0-100) from summed bleu_stats, with the brevity penalty and exponential smoothing of sacrebleu"""
+    hyp_len, ref_len = stats[0], stats[1]
+    if hyp_len == 0:
+        return 0.0
+    log_precision, smooth = 0.0, 1.0
+    orders = (len(stats) - 2) // 2
+    for n in range(orders):
+        correct, total = stats[2 + 2 * n], stats[3 + 2 * n]
+        if total == 0:
+            return 0.0
+        if correct == 0:
+            smooth *= 2
+            log_precision += math.log(1 / (smooth * total))
+        else:
+            log_precision += math.log(correct / total)
+    brevity = 1.0 if hyp_len > ref_len else math.exp(1 - ref_len / hyp_len)
+    return 100 * brevity * math.exp(log_precision / orders)
+
+
+@lru_cache(maxsize=4096)
+def char_ngrams(text: str, max_order: int=6) -> "tuple[Counter]":
+    # references and hypotheses are compared several times, the counts must not be modified
+    text = "".join(text.split())
+    return tuple(Counter(text[i:i + n] for i in range(len(text) - n + 1)) for n in range(1, max_order + 1))
+
+
+def chrf_stats(hypothesis: str, reference: str, max_order: int=6) -> "list[int]":
+    """Sufficient statistics of chrF for one sentence: matches, hypothesis and reference n-grams per order"""
+    stats = []
+    for hyp_ngrams, ref_ngrams in zip(char_ngrams(hypothesis, max_order), char_ngrams(reference, max_order)):
+        stats += [sum((hyp_ngrams & ref_ngrams).values()), sum(hyp_ngrams.values()), sum(ref_ngrams.values())]
+    return stats
+
+
+def corpus_chrf(stats: "list[int]", beta: float=2.0) -> float:
+    """chrF (0-100) from summed chrf_stats, precision and recall averaged over the orders"""
+    precisions, recalls = [], []
+    for n in range(0, len(stats), 3):
+        correct, hyp_total, ref_total = stats[n:n + 3]
+        if hyp_total and ref_total:
+            precisions.append(correct / hyp_total)
+            recalls.append(correct / ref_total)
+    if not precisions:
+        return 0.0
+    precision, recall = sum(precisions) / len(precisions), sum(recalls) / len(recalls)
+    if precision + recall == 0:
+        return 0.0
+    return 100 * (1 + beta ** 2) * precision * recall / (beta ** 2 * precision + recall)
+
+
+def sum_stats(rows: "list[list[int]]") -> "list[int]":
+    return [sum(column) for column in zip(*rows)]
@@ -0,0 +1,72 @@
+import re
+
+
+PLACEHOLDER = re.compile(r"##(\w+)##")
+
+
+class PromptTemplate:
+    def __init__(self, text: str) -> None:
+        """A prompt with ##name## placeholders, scanned once
+
+        Args:
+            text (str): the template text
+        """
+        self.text = text
+        # literal and placeholder parts alternate, literals at even indexes
+        self.parts = PLACEHOLDER.split(text)
+        self.placeholders = frozenset(self.parts[1::2])
+
+    def render(self, values: dict=None, **kwargs) -> str:
+        """Fill the placeholders in one pass
+
+        Placeholders without a value are kept as they are, and filled values are never scanned again,
+        so an answer quoting "##neg_ans##" is not substituted.
+
+        Args:
+            values (dict): placeholder name -> value
+            kwargs: more placeholder values
+
+        Returns:
+            str: the prompt
+        """
+        return "".join(self.render_parts(values, **kwargs))
+
+    def render_parts(self, values: dict=None, **kwargs) -> "tuple[str, ...]":
+        """Fill the placeholders without joining, for a Message sharing the text of the template and the values
+
+        Args: same as render
+
+        Returns:
+            tuple[str, ...]: the parts of the prompt, the literals are those of the template and the values are not copied
+        """
+        values = dict(values, **kwargs) if values else kwargs
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            parts[i] = str(values[name]) if name in values else f"##{name}##"
+        return tuple(part for part in parts if part)
+
+
+def compile_templates(config: dict, fields: "dict[str, set]") -> "dict[str, PromptTemplate]":
+    """Parse and check the templates of a config
+
+    Args:
+        config (dict): config such as config4tran.json
+        fields (dict[str, set]): template key -> placeholders it may use
+
+    Raises:
+        ValueError: a template is missing or uses an unknown placeholder
+
+    Returns:
+        dict[str, PromptTemplate]: template key -> template
+    """
+    templates = {}
+    for key, allowed in fields.items():
+        if key not in config:
+            raise ValueError(f"Missing prompt template {key}")
+        template = PromptTemplate(config[key])
+        unknown = template.placeholders - set(allowed)
+        if unknown:
+            raise ValueError(f"Unknown placeholders {sorted(unknown)} in prompt template {key}, expected some of {sorted(allowed)}")
+        templates[key] = template
+    return templates
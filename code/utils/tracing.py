@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import threading
+import contextlib
+from .openai_utils import num_tokens_from_string
+
+
+SUMMED = ["prompt_tokens", "completion_tokens", "latency", "api_time", "sleep_time", "backoff_time", "retries"]
+# summed over the streamed queries only, the mean time to first token is reported from them
+STREAMED = ["streams", "time_to_first_token"]
+
+
+class Tracer:
+    def __init__(self, path: str=None, prometheus_path: str=None) -> None:
+        """Span of every agent query, rolled up per debate and per run
+
+        A span records the agent, its role, the round, prompt and completion tokens, the wall time of the
+        query and how it splits into api time, sleep / rate limiter wait and backoff between retries, and
+        for a streamed query the time until its first piece arrived.
+        Spans and per-debate summaries are appended to a jsonl trace; totals per role are written to a
+        Prometheus textfile after every debate.
+
+        Args:
+            path (str): jsonl trace file, None to keep the summaries in memory only
+            prometheus_path (str): Prometheus textfile, rewritten atomically, None to disable
+        """
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.file = open(path, "a") if path else None
+        self.lock = threading.Lock()
+        self.prometheus_lock = threading.Lock()
+        self.local = threading.local()
+        self.debates = {}
+        self.roles = {}
+        self.num_debates = 0
+
+    @contextlib.contextmanager
+    def context(self, debate):
+        """Attribute the spans of the current thread to a debate
+
+        Args:
+            debate: debate id
+        """
+        self.attach(debate)
+        try:
+            yield
+        finally:
+            self.attach(None)
+            self.end_debate(debate)
+
+    def attach(self, debate):
+        """Attribute the spans of the current thread to a debate, for threads a debate spawns"""
+        self.local.debate = debate
+
+    def current(self):
+        """The debate the current thread works on"""
+        return getattr(self.local, "debate", None)
+
+    def start(self, agent, prompt_tokens: int, round: int=None) -> dict:
+        """Open the span of one query
+
+        Args:
+            agent (Agent): the agent asking
+            prompt_tokens (int): tokens of the messages sent
+            round (int): debate round the query belongs to, None if not played in rounds
+
+        Returns:
+            dict: the span, the agent adds its timings to it
+        """
+        return {
+            "type": "span",
+            "debate": self.current(),
+            "agent": agent.name,
+            "role": agent.role or agent.name,
+            "round": round,
+            "model": agent.model_name,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": 0,
+            "start": time.time(),
+            "latency": 0.0,
+            "api_time": 0.0,
+            "sleep_time": 0.0,
+            "backoff_time": 0.0,
+            "retries": 0,
+            "time_to_first_token": None,
+            "cached": False,
+            "error": None,
+            "_start": time.perf_counter(),
+        }
+
+    def finish(self, span: dict, completion: str=None, error: Exception=None):
+        """Close a span, roll it up and append it to the trace
+
+        Args:
+            span (dict): span of start()
+            completion (str): the answer, None if the query failed
+            error (Exception): the exception the query raised
+        """
+        span["latency"] = time.perf_counter() - span.pop("_start")
+        if completion is not None:
+            span["completion_tokens"] = num_tokens_from_string(completion, span["model"])
+        if error is not None:
+            span["error"] = type(error).__name__
+        with self.lock:
+            for totals in (self.debates.setdefault(span["debate"], {"calls": 0}), self.roles.setdefault(span["role"], {"calls": 0})):
+                totals["calls"] += 1
+                for key in SUMMED:
+                    totals[key] = totals.get(key, 0) + span[key]
+                if span["time_to_first_token"] is not None:
+                    totals["streams"] = totals.get("streams", 0) + 1
+                    totals["time_to_first_token"] = totals.get("time_to_first_token", 0) + span["time_to_first_token"]
+            if self.file is not None:
+                self.file.write(json.dumps(span, ensure_ascii=False) + "\n")
+
+    def end_debate(self, debate):
+        """Append the summary of a finished debate and refresh the Prometheus textfile"""
+        with self.lock:
+            self.num_debates += 1
+            summary = self.debates.pop(debate, {"calls": 0})
+            if self.file is not None:
+                self.file.write(json.dumps(dict(summary, type="debate", debate=debate)) + "\n")
+                self.file.flush()
+        self.write_prometheus()
+
+    def summary(self) -> dict:
+        """Totals of the run per role and overall"""
+        with self.lock:
+            return self._summary()
+
+    def _summary(self) -> dict:
+        roles = {role: dict(totals) for role, totals in self.roles.items()}
+        total = {"calls": sum(t["calls"] for t in roles.values())}
+        for key in SUMMED + STREAMED:
+            total[key] = sum(t.get(key, 0) for t in roles.values())
+        for totals in list(roles.values()) + [total]:
+            if totals.get("streams"):
+                totals["mean_time_to_first_token"] = totals["time_to_first_token"] / totals["streams"]
+        return {"debates": self.num_debates, "total": total, "roles": roles}
+
+    def write_prometheus(self):
+        if self.prometheus_path is None:
+            return
+        summary = self.summary()
+        lines = [
+            "# TYPE mad_debates_total counter",
+            f"mad_debates_total {summary['debates']}",
+        ]
+        for key in ["calls"] + SUMMED + STREAMED:
+            name = f"mad_agent_{key}_seconds_total" if key in ("latency", "api_time", "sleep_time", "backoff_time", "time_to_first_token") else f"mad_agent_{key}_total"
+            lines.append(f"# TYPE {name} counter")
+            for role, totals in sorted(summary["roles"].items()):
+                lines.append(f'{name}{{role="{role}"}} {totals.get(key, 0)}')
+        with self.prometheus_lock:
+            with open(f"{self.prometheus_path}.tmp", "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(f"{self.prometheus_path}.tmp", self.prometheus_path)
+
+    def close(self):
+        """Append the run summary and close the trace"""
+        self.write_prometheus()
+        with self.lock:
+            if self.file is not None:
+                self.file.write(json.dumps(dict(type="run", **self._summary())) + "\n")
+                self.file.close()
+                self.file = None
@@ -0,0 +1,179 @@
+import ast
+import json
+import threading
+
+
+class VerdictStream:
+    def __init__(self) -> None:
+        """Incremental parser of a streamed moderator verdict such as {"Supported Side": "...", "debate_translation": "..."}
+
+        Feed the streamed text piece by piece; string fields are available as soon as their closing quote
+        arrives, and the verdict is decided when the top-level object closes, so the rest of the stream
+        (usually irrelevant content after the json) does not have to be waited for.
+        Both json and python dict quoting are understood.
+        """
+        self.text = ""
+        self.fields = {}
+        self.decided = False
+        # len of the text up to and including the closing brace once decided
+        self.end = None
+        self.depth = 0
+        self.quote = None
+        self.escape = False
+        self.current = []
+        self.key = None
+        self.expect_key = False
+
+    def feed(self, delta: str) -> bool:
+        """Consume the next piece of the stream
+
+        Args:
+            delta (str): newly streamed text
+
+        Returns:
+            bool: whether the verdict is decided
+        """
+        offset = len(self.text)
+        self.text += delta
+        for i, char in enumerate(delta):
+            if self.decided:
+                break
+            if self.quote is not None:
+                if self.escape:
+                    self.current.append(char)
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == self.quote:
+                    self._end_string("".join(self.current))
+                    self.quote = None
+                else:
+                    self.current.append(char)
+            elif char in "\"'" and self.depth > 0:
+                self.quote = char
+                self.current = []
+            elif char == "{":
+                self.depth += 1
+                if self.depth == 1:
+                    self.expect_key = True
+            elif char == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.decided = True
+                    self.end = offset + i + 1
+            elif self.depth == 1 and char == ",":
+                self.expect_key = True
+            elif self.depth == 1 and char == ":":
+                self.expect_key = False
+        return self.decided
+
+    def _end_string(self, value: str):
+        if self.depth != 1:
+            return
+        if self.expect_key:
+            self.key = value
+        elif self.key is not None:
+            self.fields[self.key] = value
+            self.key = None
+
+
+class VerdictError(ValueError):
+    "Raised when a moderator answer holds no valid verdict"
+
+
+REPAIR_PROMPT = "Your last answer could not be read ({error}). Output only the JSON object with the keys {keys} and nothing else."
+
+
+class VerdictParser:
+    def __init__(self) -> None:
+        """Parser of moderator verdicts, shared by every debate of the process
+
+        Answers are tried as plain json first; otherwise the first {...} object is cut out of the text
+        (code fences, text around it) and read as json or as a python dict, and as a last resort the
+        string fields of an unterminated object are taken. The verdict is then checked against the
+        expected keys, and a preference against the sides of the debate. Counters of each outcome are
+        kept for report().
+        """
+        self.lock = threading.Lock()
+        self.stats = {"verdicts": 0, "fast_path": 0, "extracted": 0, "partial": 0, "parse_failures": 0, "repairs": 0, "repair_failures": 0}
+
+    def count(self, name: str):
+        with self.lock:
+            self.stats[name] += 1
+
+    def parse(self, text: str, keys: "list[str]", required: "list[str]", sides: "list[str]"=None) -> dict:
+        """Parse and validate a verdict
+
+        Args:
+            text (str): the moderator answer
+            keys (list[str]): expected keys, missing ones are set to ""
+            required (list[str]): keys that must be present
+            sides (list[str]): names of the sides, the Supported Side of a preference must name one of them; None to not check it
+
+        Raises:
+            VerdictError: no verdict could be read
+
+        Returns:
+            dict: the verdict
+        """
+        self.count("verdicts")
+        try:
+            verdict, path = self._read(text)
+            verdict = self._validate(verdict, keys, required, sides)
+        except VerdictError:
+            self.count("parse_failures")
+            raise
+        self.count(path)
+        return verdict
+
+    def _read(self, text: str) -> "tuple[dict, str]":
+        text = text.strip()
+        if text.startswith("{"):
+            try:
+                return json.loads(text), "fast_path"
+            except ValueError:
+                pass
+        stream = VerdictStream()
+        stream.feed(text)
+        start = text.find("{")
+        if start < 0:
+            raise VerdictError("no json object found")
+        if stream.decided:
+            span = text[start:stream.end]
+            for load in (json.loads, ast.literal_eval):
+                try:
+                    return load(span), "extracted"
+                except (ValueError, SyntaxError):
+                    pass
+        if stream.fields:
+            return dict(stream.fields), "partial"
+        raise VerdictError("the json object could not be parsed")
+
+    def _validate(self, verdict, keys: "list[str]", required: "list[str]", sides: "list[str]"=None) -> dict:
+        if not isinstance(verdict, dict):
+            raise VerdictError(f"expected a json object, got {type(verdict).__name__}")
+        missing = [key for key in required if key not in verdict]
+        if missing:
+            raise VerdictError(f"missing keys {missing}")
+        for key in keys:
+            value = verdict.setdefault(key, "")
+            if value is None:
+                verdict[key] = ""
+            elif not isinstance(value, str):
+                raise VerdictError(f"{key} should be a string, got {type(value).__name__}")
+        preference = verdict.get("Whether there is a preference")
+        if preference and not preference.strip().lower().startswith(("yes", "no")):
+            raise VerdictError(f"Whether there is a preference should be Yes or No, got {preference!r}")
+        if sides and preference and preference.strip().lower().startswith("yes"):
+            side = verdict.get("Supported Side", "").lower()
+            if not any(name.lower() in side for name in sides):
+                raise VerdictError(f"Supported Side should name one of {sides} when there is a preference, got {verdict.get('Supported Side', '')!r}")
+        return verdict
+
+    def report(self) -> dict:
+        """Counters and parse failure / repair rates"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats["parse_failure_rate"] = stats["parse_failures"] / stats["verdicts"] if stats["verdicts"] else 0.0
+        stats["repair_rate"] = stats["repairs"] / stats["verdicts"] if stats["verdicts"] else 0.0
+        return stats
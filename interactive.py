@@ -20,8 +20,13 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import json
 import random
+import argparse
 # random.seed(0)
 from code.utils.agent import Agent
+from code.utils.verdict import VerdictStream, VerdictParser, VerdictError, REPAIR_PROMPT
+from code.utils.templates import PromptTemplate, compile_templates
+from code.utils.message import to_dicts
+from code.utils.consensus import ConsensusDetector
 
 
 openai_api_key = "Your-OpenAI-Api-Key"
@@ -32,6 +37,23 @@ NAME_LIST=[
     "Moderator",
 ]
 
+# prompt template -> placeholders it may use
+TEMPLATE_FIELDS = {
+    "player_meta_prompt": {"debate_topic"},
+    "moderator_meta_prompt": {"debate_topic"},
+    "affirmative_prompt": {"debate_topic"},
+    "negative_prompt": {"aff_ans"},
+    "moderator_prompt": {"aff_ans", "neg_ans", "round"},
+    "judge_prompt_last1": {"aff_ans", "neg_ans"},
+    "judge_prompt_last2": {"debate_topic"},
+    "debate_prompt": {"oppo_ans"},
+}
+
+MODERATOR_KEYS = ["Whether there is a preference", "Supported Side", "Reason", "debate_answer"]
+JUDGE_KEYS = ["Reason", "debate_answer"]
+# sides the moderator may support
+SIDES = ["Affirmative", "Negative"]
+
 class DebatePlayer(Agent):
     def __init__(self, model_name: str, name: str, temperature:float, openai_api_key: str, sleep_time: float) -> None:
         """Create a player in the debate
@@ -48,6 +70,11 @@ class DebatePlayer(Agent):
 
 
 class Debate:
+    # process-wide VerdictParser, its counters cover every debate
+    verdict_parser = VerdictParser()
+    # opt-in process-wide ConsensusDetector, a round both sides agree on is decided without the moderator
+    consensus = None
+
     def __init__(self,
             model_name: str='gpt-3.5-turbo', 
             temperature: float=0, 
@@ -55,7 +82,10 @@ class Debate:
             openai_api_key: str=None,
             config: dict=None,
             max_round: int=3,
-            sleep_time: float=0
+            sleep_time: float=0,
+            stream: bool=False,
+            templates: "dict[str, PromptTemplate]"=None,
+            listener=None
         ) -> None:
         """Create a debate
 
@@ -66,6 +96,10 @@ class Debate:
             openai_api_key (str): As the parameter name suggests
             max_round (int): maximum Rounds of Debate
             sleep_time (float): sleep because of rate limits
+            stream (bool): print answers live as they are generated
+            templates (dict[str, PromptTemplate]): compiled templates of the config, compiled here if not given
+            listener (callable): called with an event dict at the start of every round and after every answer, e.g. to stream the debate to a client;
+                the debate is then only reported to the listener and prints nothing
         """
 
         self.model_name = model_name
@@ -75,6 +109,9 @@ class Debate:
         self.config = config
         self.max_round = max_round
         self.sleep_time = sleep_time
+        self.stream = stream
+        self.listener = listener
+        self.templates = templates if templates is not None else compile_templates(config, TEMPLATE_FIELDS)
 
         self.init_prompt()
 
@@ -84,12 +121,8 @@ class Debate:
 
 
     def init_prompt(self):
-        def prompt_replace(key):
-            self.config[key] = self.config[key].replace("##debate_topic##", self.config["debate_topic"])
-        prompt_replace("player_meta_prompt")
-        prompt_replace("moderator_meta_prompt")
-        prompt_replace("affirmative_prompt")
-        prompt_replace("judge_prompt_last2")
+        for key in ["player_meta_prompt", "moderator_meta_prompt", "affirmative_prompt", "judge_prompt_last2"]:
+            self.config[key] = self.templates[key].render(debate_topic=self.config["debate_topic"])
 
     def creat_agents(self):
         # creates players
@@ -107,20 +140,90 @@ class Debate:
         self.moderator.set_meta_prompt(self.config['moderator_meta_prompt'])
         
         # start: first round debate, state opinions
-        print(f"===== Debate Round-1 =====\n")
+        self.show(f"===== Debate Round-1 =====\n")
+        self.emit("round", round=1)
         self.affirmative.add_event(self.config['affirmative_prompt'])
-        self.aff_ans = self.affirmative.ask()
-        self.affirmative.add_memory(self.aff_ans)
+        self.aff_ans = self.ask_player(self.affirmative)
         self.config['base_answer'] = self.aff_ans
 
-        self.negative.add_event(self.config['negative_prompt'].replace('##aff_ans##', self.aff_ans))
-        self.neg_ans = self.negative.ask()
-        self.negative.add_memory(self.neg_ans)
+        self.negative.add_event(self.templates['negative_prompt'].render_parts(aff_ans=self.aff_ans))
+        self.neg_ans = self.ask_player(self.negative)
+
+        self.mod_ans = self.moderate('first')
+
+    def ask_player(self, player: DebatePlayer, verdict: bool=False) -> str:
+        """Ask a player and keep the answer in its memory, printing the answer live in stream mode
+
+        Args:
+            player (DebatePlayer): the player to ask
+            verdict (bool): the answer is a json verdict, stop reading once it is decided
+        """
+        if not self.stream:
+            ans = player.ask()
+            player.add_memory(ans, display=self.listener is None)
+            self.emit("answer", player=player.name, content=ans)
+            return ans
+        print(f"----- {player.name} -----")
+        verdict_stream = VerdictStream() if verdict else None
+        ans = player.ask(stream=True, on_token=lambda delta: print(delta, end="", flush=True), until=verdict_stream.feed if verdict else None)
+        print("\n")
+        if verdict and verdict_stream.decided:
+            # the last piece may run past the closing brace
+            ans = ans[:verdict_stream.end]
+        player.add_memory(ans, display=False)
+        self.emit("answer", player=player.name, content=ans)
+        return ans
+
+    def show(self, text: str):
+        # debates of a listener, e.g. of the service, run side by side and must not print over each other
+        if self.listener is None:
+            print(text)
+
+    def emit(self, event: str, **fields):
+        if self.listener is not None:
+            self.listener({"event": event, **fields})
+
+    def moderate(self, round: str) -> dict:
+        """Verdict of a round, taken without asking the moderator when both sides already agree
+
+        Args:
+            round (str): "first", "second", ...
+
+        Returns:
+            dict: the verdict
+        """
+        if self.consensus is not None:
+            candidate = self.consensus.agree([self.aff_ans, self.neg_ans])
+            if candidate is not None:
+                self.config['consensus'] = True
+                return {"Whether there is a preference": "Yes", "Supported Side": "Both", "Reason": "Both sides proposed the same answer.", "debate_answer": candidate}
+        self.moderator.add_event(self.templates['moderator_prompt'].render_parts(aff_ans=self.aff_ans, neg_ans=self.neg_ans, round=round))
+        return self.ask_verdict(self.moderator, MODERATOR_KEYS)
+
+    def ask_verdict(self, player: DebatePlayer, keys: "list[str]") -> dict:
+        """Ask a player for a json verdict, re-asking once if the answer cannot be parsed
 
-        self.moderator.add_event(self.config['moderator_prompt'].replace('##aff_ans##', self.aff_ans).replace('##neg_ans##', self.neg_ans).replace('##round##', 'first'))
-        self.mod_ans = self.moderator.ask()
-        self.moderator.add_memory(self.mod_ans)
-        self.mod_ans = eval(self.mod_ans)
+        Args:
+            player (DebatePlayer): the moderator or the judge
+            keys (list[str]): keys of the verdict, debate_answer is required
+
+        Returns:
+            dict: the verdict, with an empty debate_answer if it could not be read even after the re-ask
+        """
+        sides = SIDES if "Supported Side" in keys else None
+        ans = self.ask_player(player, verdict=True)
+        try:
+            return self.verdict_parser.parse(ans, keys, required=["debate_answer"], sides=sides)
+        except VerdictError as e:
+            error = e
+        self.verdict_parser.count("repairs")
+        player.add_event(REPAIR_PROMPT.format(error=error, keys=json.dumps(keys)))
+        ans = self.ask_player(player, verdict=True)
+        try:
+            return self.verdict_parser.parse(ans, keys, required=["debate_answer"], sides=sides)
+        except VerdictError:
+            self.verdict_parser.count("repair_failures")
+            return {key: "" for key in keys}
 
     def round_dct(self, num: int):
         dct = {
@@ -139,6 +242,18 @@ class Debate:
         print("\n----- Debate Reason -----")
         print(self.config["Reason"])
 
+    def save_file_to_json(self, path: str):
+        """Save the debate, its config with the answers and the messages of the players, as code/evaluate.py reads it
+
+        Args:
+            path (str): json file
+        """
+        save_file = dict(self.config, model_name=self.model_name, players={player.name: to_dicts(player.memory_lst) for player in self.players})
+        # write then rename, so an existing file is always a finished debate
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(save_file, f, ensure_ascii=False, indent=4)
+        os.replace(f"{path}.tmp", path)
+
     def broadcast(self, msg: str):
         """Broadcast a message to all players. 
         Typical use is for the host to announce public information
@@ -165,8 +280,7 @@ class Debate:
                 player.add_event(msg)
 
     def ask_and_speak(self, player: DebatePlayer):
-        ans = player.ask()
-        player.add_memory(ans)
+        ans = self.ask_player(player)
         self.speak(player.name, ans)
 
 
@@ -177,19 +291,15 @@ class Debate:
             if self.mod_ans["debate_answer"] != '':
                 break
             else:
-                print(f"===== Debate Round-{round+2} =====\n")
-                self.affirmative.add_event(self.config['debate_prompt'].replace('##oppo_ans##', self.neg_ans))
-                self.aff_ans = self.affirmative.ask()
-                self.affirmative.add_memory(self.aff_ans)
+                self.show(f"===== Debate Round-{round+2} =====\n")
+                self.emit("round", round=round+2)
+                self.affirmative.add_event(self.templates['debate_prompt'].render_parts(oppo_ans=self.neg_ans))
+                self.aff_ans = self.ask_player(self.affirmative)
 
-                self.negative.add_event(self.config['debate_prompt'].replace('##oppo_ans##', self.aff_ans))
-                self.neg_ans = self.negative.ask()
-                self.negative.add_memory(self.neg_ans)
+                self.negative.add_event(self.templates['debate_prompt'].render_parts(oppo_ans=self.aff_ans))
+                self.neg_ans = self.ask_player(self.negative)
 
-                self.moderator.add_event(self.config['moderator_prompt'].replace('##aff_ans##', self.aff_ans).replace('##neg_ans##', self.neg_ans).replace('##round##', self.round_dct(round+2)))
-                self.mod_ans = self.moderator.ask()
-                self.moderator.add_memory(self.mod_ans)
-                self.mod_ans = eval(self.mod_ans)
+                self.mod_ans = self.moderate(self.round_dct(round+2))
 
         if self.mod_ans["debate_answer"] != '':
             self.config.update(self.mod_ans)
@@ -204,38 +314,79 @@ class Debate:
             judge_player.set_meta_prompt(self.config['moderator_meta_prompt'])
 
             # extract answer candidates
-            judge_player.add_event(self.config['judge_prompt_last1'].replace('##aff_ans##', aff_ans).replace('##neg_ans##', neg_ans))
-            ans = judge_player.ask()
-            judge_player.add_memory(ans)
+            judge_player.add_event(self.templates['judge_prompt_last1'].render_parts(aff_ans=aff_ans, neg_ans=neg_ans))
+            ans = self.ask_player(judge_player)
 
             # select one from the candidates
             judge_player.add_event(self.config['judge_prompt_last2'])
-            ans = judge_player.ask()
-            judge_player.add_memory(ans)
-            
-            ans = eval(ans)
+            ans = self.ask_verdict(judge_player, JUDGE_KEYS)
             if ans["debate_answer"] != '':
                 self.config['success'] = True
                 # save file
             self.config.update(ans)
             self.players.append(judge_player)
 
-        self.print_answer()
+        if self.listener is None:
+            self.print_answer()
+
+
+def free_id(output_dir: str) -> int:
+    """The id after the last debate saved in output_dir, so a new run never overwrites an earlier one"""
+    ids = [int(file[:-len(".json")]) for file in os.listdir(output_dir) if file.endswith(".json") and file[:-len(".json")].isdigit()]
+    return max(ids, default=-1) + 1
+
+
+def load_topics(path: str) -> "list[str]":
+    # a json array of {"question": ...} such as CIAR.json, or one topic per line
+    if path.endswith(".json"):
+        return [item["question"] for item in json.load(open(path, "r"))]
+    return [line.strip() for line in open(path, "r") if line.strip()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("-i", "--input-file", type=str, default=None, help="Debate these topics instead of asking for them: a json array of questions such as CIAR.json, or one topic per line")
+    parser.add_argument("-o", "--output-dir", type=str, default=None, help="Save every debate as {id}.json, which code/evaluate.py scores")
+    parser.add_argument("--consensus-threshold", type=float, default=None, help="Skip the moderator when both sides give the same numbers, which score 1.0 against this threshold, off if not given")
+
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
 
     current_script_path = os.path.abspath(__file__)
     MAD_path = current_script_path.rsplit("/", 1)[0]
 
+    if args.consensus_threshold is not None:
+        # the answers are numbers, e.g. of CIAR, compared by value rather than by wording
+        Debate.consensus = ConsensusDetector(threshold=args.consensus_threshold, numeric=True)
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        id = free_id(args.output_dir)
+    topics = iter(load_topics(args.input_file)) if args.input_file is not None else None
+
+    # the prompts are loaded and compiled once, every topic gets its own copy of the config
+    config4all = json.load(open(f"{MAD_path}/code/utils/config4all.json", "r"))
+    templates4all = compile_templates(config4all, TEMPLATE_FIELDS)
     while True:
-        debate_topic = ""
-        while debate_topic == "":
-            debate_topic = input(f"\nEnter your debate topic: ")
-            
-        config = json.load(open(f"{MAD_path}/code/utils/config4all.json", "r"))
-        config['debate_topic'] = debate_topic
-
-        debate = Debate(num_players=3, openai_api_key=openai_api_key, config=config, temperature=0, sleep_time=0)
+        if topics is not None:
+            debate_topic = next(topics, None)
+            if debate_topic is None:
+                break
+        else:
+            debate_topic = ""
+            while debate_topic == "":
+                debate_topic = input(f"\nEnter your debate topic: ")
+
+        config = dict(config4all, debate_topic=debate_topic)
+
+        debate = Debate(num_players=3, openai_api_key=openai_api_key, config=config, temperature=0, sleep_time=0, stream=True, templates=templates4all)
         debate.run()
+        if args.output_dir is not None:
+            debate.save_file_to_json(os.path.join(args.output_dir, f"{id}.json"))
+            id += 1
+    if Debate.consensus is not None:
+        print(f"consensus: {Debate.consensus.report()}")
 
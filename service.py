@@ -0,0 +1,240 @@
+"""
+MAD: Multi-Agent Debate with Large Language Models
+Copyright (C) 2023  The MAD Team
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import json
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from code.utils.agent import Agent
+from code.utils.backends import OpenAIBackend, MockBackend
+from code.utils.http_client import HTTPClient
+from code.utils.openai_utils import num_tokens_from_string
+from code.utils.templates import compile_templates
+from code.utils.consensus import ConsensusDetector
+from interactive import Debate, TEMPLATE_FIELDS, free_id
+
+
+class DebateRun:
+    def __init__(self) -> None:
+        """Events of one debate, replayed to every client that asks for it, including late ones"""
+        self.events = []
+        self.subscribers = []
+        self.closed = False
+
+    def publish(self, event: dict):
+        self.events.append(event)
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def close(self):
+        self.closed = True
+        for queue in self.subscribers:
+            queue.put_nowait(None)
+
+    async def subscribe(self):
+        """Yield the events so far, then the new ones until the debate is over"""
+        queue = asyncio.Queue()
+        for event in self.events:
+            queue.put_nowait(event)
+        if self.closed:
+            queue.put_nowait(None)
+        self.subscribers.append(queue)
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.subscribers.remove(queue)
+
+
+class DebateService:
+    def __init__(self, config: dict, model_name: str='gpt-3.5-turbo', openai_api_key: str=None, max_debates: int=4, max_round: int=3, temperature: float=0, output_dir: str=None) -> None:
+        """Debates over HTTP, with the prompts compiled once and identical topics in flight coalesced
+
+        POST /debate {"topic": ..., "max_round": ..., "temperature": ...} streams the debate as json lines:
+        a "round" event per round, an "answer" event per answer and a final "done" event with the result.
+        A request for a topic that is already being debated with the same settings follows that debate
+        instead of starting another one. GET /stats returns the counters of the service.
+
+        Args:
+            config (dict): config4all.json
+            model_name (str): model name
+            openai_api_key (str): As the parameter name suggests
+            max_debates (int): debates run at the same time, later ones wait for a free slot
+            max_round (int): maximum rounds of a debate unless the request gives one
+            temperature (float): sampling temperature unless the request gives one
+            output_dir (str): save every finished debate there as {id}.json, None to keep nothing
+        """
+        self.config = config
+        self.templates = compile_templates(config, TEMPLATE_FIELDS)
+        self.model_name = model_name
+        self.openai_api_key = openai_api_key
+        self.max_round = max_round
+        self.temperature = temperature
+        self.output_dir = output_dir
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            self.next_id = free_id(output_dir)
+        self.executor = ThreadPoolExecutor(max_workers=max_debates)
+        self.slots = asyncio.Semaphore(max_debates)
+        # (normalized topic, max_round, temperature) -> DebateRun
+        self.in_flight = {}
+        self.stats = {"requests": 0, "debates": 0, "coalesced": 0, "failed": 0, "waiting": 0, "running": 0}
+        # load the tokenizer before the first request needs it
+        num_tokens_from_string("", model_name)
+
+    def debate(self, topic: str, max_round: int, temperature: float) -> DebateRun:
+        """The run of a topic, started unless the same debate is already in flight"""
+        key = (" ".join(topic.lower().split()), max_round, temperature)
+        run = self.in_flight.get(key)
+        if run is not None:
+            self.stats["coalesced"] += 1
+            return run
+        run = self.in_flight[key] = DebateRun()
+        self.stats["debates"] += 1
+        path = None
+        if self.output_dir is not None:
+            path = os.path.join(self.output_dir, f"{self.next_id}.json")
+            self.next_id += 1
+        asyncio.get_running_loop().create_task(self._run(key, run, topic, max_round, temperature, path))
+        return run
+
+    async def _run(self, key: tuple, run: DebateRun, topic: str, max_round: int, temperature: float, path: str=None):
+        loop = asyncio.get_running_loop()
+        listener = lambda event: loop.call_soon_threadsafe(run.publish, event)
+        self.stats["waiting"] += 1
+        try:
+            async with self.slots:
+                self.stats["waiting"] -= 1
+                self.stats["running"] += 1
+                try:
+                    result = await loop.run_in_executor(self.executor, self._debate, topic, max_round, temperature, listener, path)
+                finally:
+                    self.stats["running"] -= 1
+            run.publish({"event": "done", "result": result})
+        except Exception as e:
+            self.stats["failed"] += 1
+            run.publish({"event": "error", "error": f"{type(e).__name__}: {e}"})
+        finally:
+            del self.in_flight[key]
+            run.close()
+
+    def _debate(self, topic: str, max_round: int, temperature: float, listener, path: str=None) -> dict:
+        config = dict(self.config, debate_topic=topic)
+        debate = Debate(model_name=self.model_name, num_players=3, openai_api_key=self.openai_api_key, config=config, max_round=max_round, temperature=temperature, templates=self.templates, listener=listener)
+        debate.run()
+        if path is not None:
+            debate.save_file_to_json(path)
+        return {key: config.get(key, "") for key in ("debate_topic", "base_answer", "debate_answer", "Reason", "success")}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode("latin-1").split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                if method == "GET" and path.rstrip("/") == "/stats":
+                    await self.respond(writer, 200, dict(self.stats, in_flight=len(self.in_flight), consensus=Debate.consensus.report() if Debate.consensus is not None else None))
+                elif method == "POST" and path.rstrip("/") == "/debate":
+                    await self.stream_debate(writer, body)
+                else:
+                    await self.respond(writer, 404, {"error": f"no route {method} {path}"})
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+    async def stream_debate(self, writer: asyncio.StreamWriter, body: bytes):
+        self.stats["requests"] += 1
+        try:
+            request = json.loads(body or b"{}")
+            topic = request["topic"].strip()
+            max_round = int(request.get("max_round", self.max_round))
+            temperature = float(request.get("temperature", self.temperature))
+            if not topic or not 1 <= max_round <= 10:
+                raise ValueError("topic must not be empty and max_round between 1 and 10")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            await self.respond(writer, 400, {"error": f"bad request: {e}"})
+            return
+        run = self.debate(topic, max_round, temperature)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n")
+        async for event in run.subscribe():
+            data = json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n"
+            writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+async def serve(service: DebateService, host: str, port: int):
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"debate service on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind")
+    parser.add_argument("--port", type=int, default=8080, help="Port to bind")
+    parser.add_argument("-k", "--api-key", type=str, default=os.environ.get("OPENAI_API_KEY"), help="OpenAI api key")
+    parser.add_argument("-m", "--model-name", type=str, default="gpt-3.5-turbo", help="Model name")
+    parser.add_argument("-t", "--temperature", type=float, default=0, help="Sampling temperature unless a request gives one")
+    parser.add_argument("--max-round", type=int, default=3, help="Maximum rounds unless a request gives them")
+    parser.add_argument("--max-debates", type=int, default=4, help="Debates running at the same time")
+    parser.add_argument("--backend", type=str, default="openai", choices=["openai", "mock"], help="Where chat requests go")
+    parser.add_argument("--api-base", type=str, default=None, help="Base url of an openai compatible server, e.g. utils.mock_server")
+    parser.add_argument("--mock-latency", type=float, default=0, help="Seconds per request of the mock backend")
+    parser.add_argument("--consensus-threshold", type=float, default=None, help="Skip the moderator when both sides give the same numbers, which score 1.0 against this threshold, off if not given")
+    parser.add_argument("-o", "--output-dir", type=str, default=None, help="Save every finished debate as {id}.json, which code/evaluate.py scores")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    MAD_path = os.path.abspath(__file__).rsplit("/", 1)[0]
+
+    if args.backend == "mock":
+        Agent.backend = MockBackend(latency=args.mock_latency)
+    else:
+        Agent.backend = OpenAIBackend(api_base=args.api_base, client=HTTPClient())
+    if args.consensus_threshold is not None:
+        # the answers are numbers, e.g. of CIAR, compared by value rather than by wording
+        Debate.consensus = ConsensusDetector(threshold=args.consensus_threshold, numeric=True)
+    config = json.load(open(f"{MAD_path}/code/utils/config4all.json", "r"))
+    asyncio.run(serve(DebateService(config, model_name=args.model_name, openai_api_key=args.api_key, max_debates=args.max_debates, max_round=args.max_round, temperature=args.temperature, output_dir=args.output_dir), args.host, args.port))